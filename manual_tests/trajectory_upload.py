@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+"""
+Checks /crazyflie/{drone_id}/trajectory/upload against a simulated drone :
+the uploaded pieces are evaluated like the high level commander does,
+and compared with the server side interpolation of the same waypoints.
+"""
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from server_osc_modules import CrazyflieModule, SwarmState, Scheduler, OscRouter, Trajectory
+from server_osc_modules.trajectory import parse_waypoints, evaluate_poly4d
+
+
+class SimulatedDrone(object):
+	"""
+	Stand-in for a Crazyflie object : keeps what is written to its trajectory memory.
+	"""
+
+	class Memory(object):
+		size = 4096
+
+		def __init__(self):
+			self.poly4Ds = []
+
+		def write_data(self, callback):
+			callback(self, 0)
+
+	class Commander(object):
+		def __init__(self):
+			self.calls = []
+
+		def __getattr__(self, name):
+			return lambda *args, **kwargs: self.calls.append((name, args, kwargs))
+
+	def __init__(self):
+		self.memory = self.Memory()
+		self.high_level_commander = self.Commander()
+		self.commander = self.Commander()
+		self.mem = self
+		self.param = self.Commander()
+		self.param.toc = self
+		self.toc = {}
+
+	def get_mems(self, memory_type):
+		return [self.memory]
+
+	def pieces(self):
+		durations = np.array([poly.duration for poly in self.memory.poly4Ds])
+		coefficients = np.array([[poly.x.values, poly.y.values, poly.z.values, poly.yaw.values]
+			for poly in self.memory.poly4Ds])
+		return durations, coefficients
+
+
+class InlineRadio(object):
+	def push(self, priority, command, key=None, max_age=None):
+		command()
+
+
+class Server(object):
+	def __init__(self):
+		self.scheduler = Scheduler()
+		self.swarm = SwarmState()
+		self.drones = {}
+		self.modules = {}
+		self.engine = self
+		self.sent = []
+
+	def marshal(self, callback):
+		return callback
+
+	def get_module(self, name):
+		return self if name == 'CLIENT' else self.modules.get(name)
+
+	def broadcast(self, address, data):
+		self.sent.append((address, data))
+
+
+def upload(module, drone, waypoints, interpolation):
+	drone.memory.poly4Ds = []
+	module.osc_upload_trajectory('/crazyflie/0/trajectory/upload',
+		*(list(waypoints.ravel()) + [interpolation]), drone_id=0)
+	return drone.memory.poly4Ds
+
+
+if __name__ == '__main__':
+	server = Server()
+	module = CrazyflieModule(server=server, base_topic='/crazyflie')
+	module(OscRouter())
+	server.modules[CrazyflieModule.get_name()] = module
+	drone = SimulatedDrone()
+	server.drones[0] = {'cf': drone, 'connected': True, 'radio': InlineRadio()}
+	server.swarm.add(0)
+	server.swarm.set_connected(0, True)
+	server.swarm.set_geofence([-2, -2, 0], [2, 2, 2])
+
+	waypoints = parse_waypoints([
+		0, 0, 0, 0.5, 0,
+		1, 1, 0, 1, 0,
+		2.5, 1, 1, 1, 90,
+		4, 0, 1, 0.5, 90,
+	])
+	for interpolation in Trajectory.INTERPOLATIONS:
+		assert upload(module, drone, waypoints, interpolation), interpolation + ' upload rejected'
+		durations, coefficients = drone.pieces()
+		trajectory = Trajectory(waypoints, interpolation)
+		error = max(np.abs(evaluate_poly4d(durations, coefficients, t) - trajectory.sample(t)).max()
+			for t in np.linspace(-0.5, trajectory.duration + 0.5, 200))
+		print(interpolation, len(durations), 'pieces, max error', error)
+		assert error < 1e-3
+
+	assert not upload(module, drone, waypoints[:1], 'cubic'), 'single waypoint accepted'
+	overshoot = parse_waypoints([0, 0, 0, 0.1, 0, 1, 1.9, 0, 1, 0, 1.2, 2, 0, 1, 0, 3, 0, 0, 1, 0])
+	assert not upload(module, drone, overshoot, 'cubic'), 'geofence overshoot accepted'
+	assert upload(module, drone, overshoot, 'linear'), 'linear upload in the geofence rejected'
+
+	# stopped mid-flight without a known position : hovers where it was sent, motors on
+	assert upload(module, drone, waypoints, 'cubic')
+	module.osc_start_trajectory('/crazyflie/0/trajectory/start', drone_id=0)
+	module.osc_stop_trajectory('/crazyflie/0/trajectory/stop', drone_id=0)
+	goal = server.swarm.goals[server.swarm.slots[0]]
+	assert 'stop' not in [call[0] for call in drone.high_level_commander.calls], 'motors cut'
+	assert np.abs(goal - waypoints[0, 1:]).max() < 1e-3, goal
+
+	# stopped with a known position, in a shifted frame : holds that position, no jump
+	server.swarm.set_frame_offset([0, 0, 0.5, 0])
+	assert upload(module, drone, waypoints, 'cubic')
+	module.osc_start_trajectory('/crazyflie/0/trajectory/start', drone_id=0)
+	server.swarm.set_position(0, [1, 0.5, 1.2])
+	module.osc_stop_trajectory('/crazyflie/0/trajectory/stop', drone_id=0)
+	ids, _, setpoints = server.swarm.setpoints()
+	assert np.abs(setpoints[list(ids).index(0), :3] - [1, 0.5, 1.2]).max() < 1e-9, setpoints
+	print('ok')
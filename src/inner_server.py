@@ -5,34 +5,42 @@ Main server code
 dispatches requests to correct modules
 """
 import argparse
+import os
 
 from server_osc_modules import *
 
-from pythonosc import dispatcher
-from pythonosc import osc_server
-from pythonosc import udp_client
-
-from threading import Thread
-import time
-
-
 import cflib
 
 class Server(object):
 	"""
 	The main server
 	"""
-	def __init__(self):
-		self._osc_server = None
-		self._osc_server_thread = None
+	def __init__(self, engine=None, connect_per_radio=2, toc_cache=None):
+		# runs the OSC server, the periodic jobs and the cflib callbacks
+		self.engine = engine if engine is not None else ThreadEngine()
+		# concurrent drone connections through each radio
+		self.connect_per_radio = connect_per_radio
+		# log and param TOCs of every drone, by CRC (toc_cache is the directory to keep them in)
+		self.toc_cache = SharedTocCache(toc_cache)
+		# periodic and one-shot jobs of every module
+		self.scheduler = self.engine.scheduler
+		self.running = False
 
 		self.modules = {}
 
-		self.dispatcher = dispatcher.Dispatcher()
+		self.dispatcher = OscRouter(scheduler=self.scheduler)
 		# DroneModule
 		self.drones = {};
+		# goals, flags and last position of the drones, as arrays
+		self.swarm = SwarmState()
 		# ClientModule
 		self.osc_clients = {}
+		# StatsModule : name -> function returning a dict of counters
+		self.stats = {
+			'scheduler': self.scheduler.stats,
+			'bundles': self.dispatcher.bundle_stats,
+			'toc_cache': self.toc_cache.stats,
+		}
 		# LpsModule
 		self.lps_node_number = 8
 		self.lps_positions = [None] * self.lps_node_number
@@ -51,19 +59,24 @@ class Server(object):
 		/lps/* -> See LpsModule
 		/log/* -> See LogModule
 		/param/* -> See ParamModule
+		/stats/* -> See StatsModule
 		"""
 
 		self.modules = {
 			ClientModule.get_name():
-				ClientModule(base_topic='/client', server=self, debug=False),
+				ClientModule(base_topic='/client', server=self, debug=False,
+					flush_interval=0.005), # 5ms bundling window
 			CrazyflieModule.get_name():
-				CrazyflieModule(base_topic='/crazyflie', server=self, debug=True),
+				CrazyflieModule(base_topic='/crazyflie', server=self, debug=True,
+					connect_per_radio=self.connect_per_radio),
 			LpsModule.get_name():
 				LpsModule(base_topic='/lps', server=self, debug=True),
 			LogModule.get_name():
 				LogModule(base_topic='/log', server=self, debug=True),
 			ParamModule.get_name():
 				ParamModule(base_topic='/param', server=self, debug=True),
+			StatsModule.get_name():
+				StatsModule(base_topic='/stats', server=self, debug=False),
 
 			#TestModule.get_name():
 			#	TestModule(base_topic='/test', server=self, debug=False),
@@ -77,29 +90,23 @@ class Server(object):
 		self.running = True
 		self.ip = args.ip
 		self.port = args.port
-		self._osc_server = osc_server.ThreadingOSCUDPServer(
-			(self.ip, self.port), self.dispatcher)
-		print("Serving on {}".format(self._osc_server.server_address))
-		self._osc_server_thread = Thread(target=self._osc_server.serve_forever)
-		self._osc_server_thread.start()
+		address = self.engine.serve((self.ip, self.port), self.dispatcher)
+		self.stats['ingest'] = self.engine.stats
+		print("Serving on {} ({} engine)".format(address, self.engine.name))
 
 		for module in self.modules:
 			self.modules[module].start()
 
-		while self.running: # windows is trash
-			time.sleep(1)
-		# self._osc_server_thread.join()
-		self._osc_server_thread = None
-		self._osc_server = None
+		self.engine.run()
 
 
 	def stop(self):
-		self.running = False
-		if self._osc_server:
+		if self.running:
+			self.running = False
 			print('stopping inner server')
 			for module in self.modules.values():
 				module.stop()
-			self._osc_server.shutdown()
+			self.engine.stop()
 
 if __name__ == "__main__":
 
@@ -114,6 +121,18 @@ if __name__ == "__main__":
 		default="0.0.0.0", help="The ip to listen on")
 	parser.add_argument("--port",
 		type=int, default=5005, help="The port to listen on")
+	parser.add_argument("--workers",
+		type=int, default=4, help="The number of threads handling OSC messages")
+	parser.add_argument("--queue_size",
+		type=int, default=1024, help="The maximum number of OSC packets waiting for a worker")
+	parser.add_argument("--engine",
+		default="threads", choices=["threads", "asyncio"],
+		help="threads: worker pool and timer threads. asyncio: everything on one event loop")
+	parser.add_argument("--connect_per_radio",
+		type=int, default=2, help="The maximum number of drones connecting at once through each radio")
+	parser.add_argument("--toc_cache",
+		default=os.path.join(os.path.expanduser('~'), '.cache', 'crazyflie-osc', 'toc'),
+		help="The directory to keep the drones TOCs in ('' to keep them in memory only)")
 	args = parser.parse_args()
 
 	cflib.crtp.init_drivers(enable_debug_driver=False)
@@ -138,6 +157,11 @@ if __name__ == "__main__":
 
 	signal.signal(signal.SIGINT, sigint_handler)
 
-	server = Server()
+	if args.engine == 'asyncio':
+		engine = AsyncioEngine()
+	else:
+		engine = ThreadEngine(workers=args.workers, queue_size=args.queue_size)
+
+	server = Server(engine, connect_per_radio=args.connect_per_radio, toc_cache=args.toc_cache)
 	server.build_routes()
 	server.run(args)
@@ -6,10 +6,7 @@ dispatches requests to correct modules
 """
 import argparse
 
-from server_osc_modules import MetaServerModule
-
-from pythonosc import dispatcher
-from pythonosc import osc_server
+from server_osc_modules import MetaServerModule, OscRouter, OscIngestServer
 
 from threading import Thread
 import time
@@ -24,7 +21,7 @@ class MetaServer(object):
 
 		self.modules = {}
 
-		self.dispatcher = dispatcher.Dispatcher()
+		self.dispatcher = OscRouter()
 
 		self.inner_server = None
 		self.args = None
@@ -51,8 +48,8 @@ class MetaServer(object):
 		self.running = True
 		self.ip = args.ip
 		self.port = args.meta_port
-		self._osc_server = osc_server.ThreadingOSCUDPServer(
-			(self.ip, self.port), self.dispatcher)
+		self._osc_server = OscIngestServer(
+			(self.ip, self.port), self.dispatcher, workers=1)
 		print("Serving on {}".format(self._osc_server.server_address))
 		self._osc_server_thread = Thread(target=self._osc_server.serve_forever)
 		self._osc_server_thread.start()
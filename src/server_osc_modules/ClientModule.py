@@ -1,23 +1,82 @@
 from .OscModule import OscModule
-from pythonosc import udp_client
+from .osc_scheduler import PRIORITY_NORMAL
+from .osc_encoder import OscEncoder
+from .osc_outbox import OscOutbox
+from .osc_sender import OscSender
+from .osc_subscriptions import SubscriptionTrie, RateLimiter
+from .chunked_transfer import ChunkedTransfers, CHUNK_SIZE
+import json
+import time
 
 class ClientModule(OscModule):
 
 	"""
 	ClientModule class. Implements OSC routes related to OSC clients
 	It allows to subscribe clients to packets this server sends
+
+	A client without subscriptions receives every message,
+	otherwise only the messages matching the patterns it subscribed to.
+	A subscription can be rate limited : the server then only sends
+	the latest value of each address, at most max_rate times per second.
+
+	Outgoing messages are encoded once, buffered for flush_interval seconds
+	and sent to each client as MTU-sized OSC bundles, through a single shared socket.
+	server.osc_clients holds the sending counters of each client.
+
+	Large payloads (JSON TOCs, snapshots, stats) are sent as a manifest and
+	sequenced chunks of at most chunk_size characters (see ChunkedTransfers) :
+	missing chunks can be asked again on /resend.
 	"""
 
 	@staticmethod
 	def get_name():
 		return 'CLIENT'
 
-	def __init__(self, server, base_topic, debug=False):
+	def __init__(self, server, base_topic, debug=False, flush_interval=0.005, mtu=1400,
+			chunk_size=CHUNK_SIZE):
 		super(ClientModule, self).__init__(server=server, base_topic=base_topic, debug=debug)
+		self.flush_interval = flush_interval
+		self.transfers = ChunkedTransfers(chunk_size)
+		self.encoder = OscEncoder()
+		self.sender = OscSender()
+		self.outbox = OscOutbox(self.sender.send_many, mtu=mtu)
+		self.flush_job = None
+
+		self.subscriptions = {} # (ip, port) -> set of patterns
+		self.topics = SubscriptionTrie()
+		self.rate_limiter = RateLimiter()
+		self._recipients_cache = {}
 
 	def routes(self):
 		self.add_route('/add', self.osc_add_client)
 		self.add_route('/remove', self.osc_remove_client)
+		self.add_route('/subscribe', self.osc_subscribe)
+		self.add_route('/unsubscribe', self.osc_unsubscribe)
+		self.add_route('/send_stats', self.osc_send_stats)
+		self.add_route('/resend', self.osc_resend)
+
+
+	def start(self):
+		self.server.stats['clients'] = self.sender.stats
+		self.server.stats['transfers'] = self.transfers.stats
+		# rate limited subscriptions need the timer even without bundling
+		self.flush_job = self.server.scheduler.every(self.flush_interval or 0.01, self._flush,
+			priority=PRIORITY_NORMAL, name='client_flush')
+
+
+	def _flush(self):
+		for key, dgram in self.rate_limiter.due(time.monotonic()):
+			self.outbox.push(key, dgram)
+		self.outbox.flush()
+
+
+	def stop(self):
+		if self.flush_job is not None:
+			self.flush_job.cancel()
+			self.flush_job = None
+		self.outbox.flush()
+		self.sender.close()
+
 
 	def osc_add_client(self, address, ip, port):
 		"""
@@ -37,7 +96,12 @@ class ClientModule(OscModule):
 
 		self._debug('adding client', ip+':'+str(port))
 		if (ip, port) not in self.server.osc_clients:
-			self.server.osc_clients[(ip, port)] = udp_client.SimpleUDPClient(ip, port)
+			try:
+				self.server.osc_clients[(ip, port)] = self.sender.add_client(ip, port)
+			except OSError as e:
+				self._error('cannot resolve client', ip+':'+str(port), e)
+				return
+			self._recipients_cache = {}
 			self._debug('success')
 		else:
 			self._debug('failure')
@@ -61,16 +125,178 @@ class ClientModule(OscModule):
 		self._debug('removing client', ip+':'+str(port))
 		if (ip, port) in self.server.osc_clients:
 			del self.server.osc_clients[(ip, port)]
+			self.sender.remove_client(ip, port)
+			self.outbox.discard((ip, port))
+			self.rate_limiter.remove_client((ip, port))
+			for pattern in self.subscriptions.pop((ip, port), ()):
+				self.topics.unsubscribe((ip, port), pattern)
+			self._recipients_cache = {}
 			self._debug('success')
 		else:
 			self._debug('failure')
 
 
+	def osc_subscribe(self, address, ip, port, pattern, max_rate=0):
+		"""
+		Subscribes a client to an OSC address pattern.
+		Once subscribed to a pattern, a client only receives the messages matching one of its patterns.
+
+		OSC listen: /subscribe
+
+		:param ip: the client ip.
+		:type ip: str.
+		:param port: the client port.
+		:type port: int.
+		:param pattern: the OSC address pattern (ex: /log/*/battery). Matches every address under it.
+		:type pattern: str.
+		:param max_rate: optional. The maximum number of messages per second for each address. 0 for no limit.
+		:type max_rate: float.
+
+		"""
+
+		key = (str(ip), int(port))
+		pattern = str(pattern)
+		max_rate = float(max_rate)
+
+		if key not in self.server.osc_clients:
+			self._error('client', key[0]+':'+str(key[1]), 'not found')
+			return
+
+		self._debug('subscribing', key[0]+':'+str(key[1]), 'to', pattern,
+			'at max', max_rate, 'Hz' if max_rate > 0 else '(no limit)')
+		try:
+			self.topics.subscribe(key, pattern, 1.0 / max_rate if max_rate > 0 else 0)
+		except ValueError as e:
+			self._error('cannot subscribe', key[0]+':'+str(key[1]), 'to', pattern, ':', e)
+			return
+		self.subscriptions.setdefault(key, set()).add(pattern)
+		self._recipients_cache = {}
+
+
+	def osc_unsubscribe(self, address, ip, port, pattern):
+		"""
+		Unsubscribes a client from an OSC address pattern.
+		A client without any subscription left receives every message again.
+
+		OSC listen: /unsubscribe
+
+		:param ip: the client ip.
+		:type ip: str.
+		:param port: the client port.
+		:type port: int.
+		:param pattern: the OSC address pattern given to /subscribe.
+		:type pattern: str.
+
+		"""
+
+		key = (str(ip), int(port))
+		pattern = str(pattern)
+
+		self._debug('unsubscribing', key[0]+':'+str(key[1]), 'from', pattern)
+		if self.topics.unsubscribe(key, pattern):
+			self.subscriptions[key].discard(pattern)
+			if not self.subscriptions[key]:
+				del self.subscriptions[key]
+			# only the addresses not rate limited by another pattern of the client anymore
+			for topic in self.rate_limiter.addresses(key):
+				if not self.topics.subscribers(topic).get(key):
+					self.rate_limiter.remove_topic(key, topic)
+			self._recipients_cache = {}
+		else:
+			self._debug('failure')
+
+
+	def osc_send_stats(self, address, *args):
+		"""
+		Sends the sending counters (sent, dropped, errors) of every client as JSON.
+
+		OSC listen: /send_stats
+
+		OSC publish: /stats -> json (chunked when large)
+		"""
+
+		self._send_chunked('/stats', json.dumps(self.sender.stats()))
+
+
+	def osc_resend(self, address, ip, port, transfer_id, *indexes):
+		"""
+		Sends again chunks of a chunked payload to one client.
+
+		OSC listen: /resend
+
+		:param ip: the client ip.
+		:type ip: str.
+		:param port: the client port.
+		:type port: int.
+		:param transfer_id: the transfer id, from the manifest.
+		:type transfer_id: int.
+		:param indexes: optional. The indexes of the missing chunks. The manifest and every chunk if none.
+		:type indexes: int.
+
+		"""
+
+		key = (str(ip), int(port))
+		transfer_id = int(transfer_id)
+
+		if key not in self.server.osc_clients:
+			self._error('client', key[0]+':'+str(key[1]), 'not found')
+			return
+		messages = self.transfers.resend(transfer_id, [int(i) for i in indexes])
+		if messages is None:
+			self._error('transfer', transfer_id, 'expired')
+			return
+		for message_address, data in messages:
+			self.outbox.push(key, self.encoder.encode(message_address, data))
+		if not self.flush_interval:
+			self.outbox.flush()
+
+
+	def _recipients(self, address):
+		"""
+		Returns the clients which should receive address, as a list of (client, period) tuples
+		(cached per address).
+		"""
+		cache = self._recipients_cache
+		if address not in cache:
+			recipients = self.topics.subscribers(address)
+			recipients.update((key, 0) for key in self.server.osc_clients
+				if key not in self.subscriptions)
+			cache[address] = list(recipients.items())
+		return cache[address]
+
+
 	def broadcast(self, address, data):
 		self._debug('broadcasting to', address)
 
-		for key, value in self.server.osc_clients.items():
-			try:
-				value.send_message(address, data)
-			except BlockingIOError as e:
-				pass
\ No newline at end of file
+		recipients = self._recipients(address)
+		if not recipients:
+			return
+		dgram = self.encoder.encode(address, data)
+		now = time.monotonic()
+		for key, period in recipients:
+			if period:
+				if self.rate_limiter.offer(key, address, dgram, period, now) is None:
+					continue
+			self.outbox.push(key, dgram)
+		if not self.flush_interval:
+			self.outbox.flush()
+
+
+	def broadcast_chunked(self, address, payload):
+		"""
+		Broadcasts a string payload, as a manifest and chunks if it does not fit in one chunk.
+		"""
+		messages = self.transfers.split(address, payload)
+		if len(messages) == 1:
+			self.broadcast(*messages[0])
+			return
+		# every chunk is needed : not decimated by rate limited subscriptions
+		for message_address, data in messages:
+			recipients = self._recipients(message_address)
+			if not recipients:
+				continue
+			dgram = self.encoder.encode(message_address, data)
+			for key, _ in recipients:
+				self.outbox.push(key, dgram)
+		if not self.flush_interval:
+			self.outbox.flush()
@@ -2,16 +2,52 @@ from .OscModule import OscModule
 from cflib.crazyflie.log import LogConfig
 from cflib.crazyflie import Crazyflie
 from .osc_validators import *
+from .osc_scheduler import PRIORITY_HIGH, PRIORITY_LOW
+from .osc_ingest import receive_time
+from .radio_queue import (RadioCommandQueue, PRIORITY_EMERGENCY, PRIORITY_SETPOINT,
+	PRIORITY_PARAM, PRIORITY_TOC)
+from .connection_batch import ConnectionBatch
+from .swarm_state import DEFAULT_RATE, MAX_RATE, parse_goals
+from .trajectory import Trajectory, parse_waypoints, evaluate_poly4d, poly4d_bounds, POLY4D_PIECE_SIZE
 import cflib
+import json
 import threading
+import time
 
-def set_interval(func, interval, *args, **kwargs):
-	stopped = threading.Event()
-	def loop():
-		while not stopped.wait(interval): # the first call is in `interval` secs
-			func(*args, **kwargs)
-	threading.Thread(target=loop).start()
-	return stopped.set
+from functools import partial
+
+import numpy as np
+
+try:
+	from cflib.crazyflie.mem import MemoryElement, Poly4D
+except ImportError: # crazyflie-lib without high level commander support
+	MemoryElement = Poly4D = None
+
+# onboard trajectories are all uploaded at the start of the trajectory memory, with this ID
+ONBOARD_TRAJECTORY_ID = 1
+
+# after an emergency, stop setpoints are repeated every EMERGENCY_REPEAT_INTERVAL
+# during EMERGENCY_REPEAT_PERIOD seconds (then at the drone setpoint rate)
+EMERGENCY_REPEAT_PERIOD = 1.0
+EMERGENCY_REPEAT_INTERVAL = 0.02
+
+# link quality (0 -> 100) under which optional traffic (logs, link quality reports) is slowed down
+# by DEGRADED_SLOWDOWN, and over which it is restored
+LINK_DEGRADED_QUALITY = 60
+LINK_RESTORED_QUALITY = 80
+DEGRADED_SLOWDOWN = 4
+LINK_QUALITY_PERIOD = 0.1 # 10Hz
+# radio commands waiting or being sent above which a link is considered degraded (or restored, below)
+LINK_DEGRADED_OUTSTANDING = 8
+LINK_RESTORED_OUTSTANDING = 2
+
+# setpoints older than this many periods are not sent anymore
+SETPOINT_MAX_AGE_PERIODS = 2
+
+# once connected, the drone setup (param writes, loggers start) acknowledged by the drone
+# in SETUP_PHASES, reported as done anyway after CONNECTION_SETUP_TIMEOUT seconds
+SETUP_PHASES = ('params', 'loggers')
+CONNECTION_SETUP_TIMEOUT = 5.0
 
 class CrazyflieModule(OscModule):
 
@@ -23,6 +59,11 @@ class CrazyflieModule(OscModule):
 	/{drone_id}/connection -> bool (true if success, false otherwise)
 	/{drone_id}/disconnection -> void
 	/{drone_id}/link_quality -> float (0 -> 100)
+	/{drone_id}/link_degraded -> bool (optional traffic slowed down while true)
+	/{drone_id}/trajectory/uploaded -> float (duration)
+	/{drone_id}/trajectory/done -> bool
+	/{drone_id}/connection/timings -> json (seconds spent in each connection phase, see _finish_setup)
+	/connect_many/done -> json (drone_id -> timings, or error)
 	
 	"""
 
@@ -31,32 +72,121 @@ class CrazyflieModule(OscModule):
 		return 'CRAZYFLIE'
 
 
-	def __init__(self, server, base_topic, debug=False):
+	def __init__(self, server, base_topic, debug=False, connect_per_radio=2):
 		super(CrazyflieModule, self).__init__(server=server, base_topic=base_topic, debug=debug)
 
-		# Send goals to drones
-
-		def send_goal(self):
-			for drone in self.server.drones.values():
-				if drone['connected']:
-					if drone['emergency']:
-						drone['cf'].commander.send_stop_setpoint()
-					elif drone['goal'] is not None:
-						x, y, z, yaw = drone['goal']
-						z = max(0, z) # do not send negative z waypoints
-						(drone['cf']
-						.commander
-						.send_setpoint(y, x, yaw, int(z*1000)))
-		self.stop_goal_timer = set_interval(send_goal, 0.1, self) # 10Hz
+		# concurrent connections per radio in /connect_many
+		self.connect_per_radio = connect_per_radio
+		# setup phases end from cflib callbacks, the timeout from the scheduler
+		self._setup_lock = threading.Lock()
+
+		# Send goals to drones, one scheduler job per setpoint rate
+		# (frame transform and geofencing are done for the whole swarm by SwarmState)
+		# rate jobs are added and cancelled from the OSC workers
+		self._rate_jobs_lock = threading.Lock()
+		self.rate_jobs = {}
+		self.trajectories = {} # drone_id -> (Trajectory, start time)
+		self.onboard_trajectories = {} # drone_id -> uploaded trajectory infos
+		with self._rate_jobs_lock:
+			self._add_rate_job(DEFAULT_RATE)
+
+		# emergency stops do not wait for the setpoints jobs
+		self._emergency_lock = threading.Lock()
+		self.emergency_repeats = {} # drone_id -> time until which stop setpoints are repeated
+		self.emergency_job = None
+		self.emergencies = 0
+		self.emergency_stops_sent = 0
+		self.emergency_latencies = [0, 0.0, 0.0, 0.0] # count, total, max, last
+
+
+	def _add_rate_job(self, rate):
+		# called with _rate_jobs_lock held
+		if rate not in self.rate_jobs:
+			self.rate_jobs[rate] = self.server.scheduler.every(1.0 / rate,
+				lambda: self._send_goals(rate),
+				priority=PRIORITY_HIGH, name='goals/{:g}Hz'.format(rate))
+
+
+	def _update_rate_jobs(self):
+		with self._rate_jobs_lock:
+			rates = self.server.swarm.rates() | {DEFAULT_RATE}
+			for rate in rates:
+				self._add_rate_job(rate)
+			for rate in [rate for rate in self.rate_jobs if rate not in rates]:
+				self.rate_jobs.pop(rate).cancel()
+
+
+	def _update_trajectories(self, rate):
+		"""
+		Moves the goals of the drones following a trajectory at rate.
+		"""
+		now = time.monotonic()
+		for drone_id, (trajectory, start) in list(self.trajectories.items()):
+			try:
+				if self.server.swarm.get_rate(drone_id) != rate:
+					continue
+				self.server.swarm.set_goal(drone_id, trajectory.sample(now - start))
+			except KeyError:
+				# removed from the swarm meanwhile
+				self.trajectories.pop(drone_id, None)
+				continue
+			except ValueError as e:
+				self._error('trajectory of drone', drone_id, 'stopped:', e)
+				self.trajectories.pop(drone_id, None)
+				continue
+			if now - start >= trajectory.duration:
+				self.trajectories.pop(drone_id, None)
+
+
+	def _send_goals(self, rate):
+		self._update_trajectories(rate)
+		ids, emergency, goals = self.server.swarm.setpoints(rate)
+		for drone_id, stop, (x, y, z, yaw) in zip(ids.tolist(), emergency.tolist(), goals.tolist()):
+			drone = self.server.drones.get(drone_id)
+			if drone is None:
+				continue
+			commander = drone['cf'].commander
+			if stop:
+				command = commander.send_stop_setpoint
+			else:
+				try:
+					command = partial(commander.send_setpoint, y, x, yaw, int(z*1000))
+				except (ValueError, OverflowError) as e:
+					# one bad goal must not stop the setpoints of the other drones
+					self._error('bad goal for drone', drone_id, ':', e)
+					continue
+			# only the latest setpoint matters, and only while it is fresh
+			drone['radio'].push(PRIORITY_SETPOINT, command, key='setpoint',
+				max_age=SETPOINT_MAX_AGE_PERIODS / rate)
 
 
 	def routes(self):
-		self.add_route('/{drone_id}/add', self.osc_add_drone)
-		self.add_route('/{drone_id}/remove', self.osc_remove_drone)
-		self.add_route('/{drone_id}/goal', self.osc_goal)
-		self.add_route('/{drone_id}/goal/stop', self.osc_reset_goal)
-		self.add_route('/{drones}/emergency', self.osc_emergency)
+		self.add_route('/{drone_id:int}/add', self.osc_add_drone)
+		self.add_route('/connect_many', self.osc_connect_many)
+		self.add_route('/{drone_id:int}/remove', self.osc_remove_drone)
+		self.add_route('/{drone_id:int}/goal', self.osc_goal, signature='ffff', coalesce=True)
+		self.add_route('/{drone_id:int}/goal/stop', self.osc_reset_goal)
+		# not coalesced : a large swarm sends its goals in several datagrams, for different drones
+		self.add_route('/swarm/goals', self.osc_swarm_goals, signature='b')
+		self.add_route('/swarm/send_state', self.osc_send_swarm_state)
+		self.add_route('/{drone_id:int}/trajectory', self.osc_trajectory)
+		self.add_route('/{drone_id:int}/trajectory/stop', self.osc_stop_trajectory)
+		self.add_route('/{drone_id:int}/trajectory/upload', self.osc_upload_trajectory)
+		self.add_route('/{drone_id:int}/trajectory/start', self.osc_start_trajectory)
+		self.add_route('/{drone_id:int}/rate', self.osc_set_rate)
+		self.add_route('/{drones}/emergency', self.osc_emergency, urgent=True)
 		self.add_route('/{drones}/lps/{nodes}/update_pos', self.osc_update_lps_pos)
+		self.add_route('/geofence', self.osc_set_geofence)
+		self.add_route('/frame_offset', self.osc_set_frame_offset)
+
+
+	def start(self):
+		self.server.stats['emergency'] = self.emergency_stats
+		self.server.stats['radio'] = self.radio_stats
+
+
+	def radio_stats(self):
+		return {drone_id: drone['radio'].stats() for drone_id, drone in list(self.server.drones.items())}
 
 
 	def stop(self):
@@ -64,7 +194,14 @@ class CrazyflieModule(OscModule):
 		for did in drones_ids:
 			self.osc_remove_drone('', drone_id=did)
 
-		self.stop_goal_timer()
+		with self._rate_jobs_lock:
+			for job in self.rate_jobs.values():
+				job.cancel()
+			self.rate_jobs = {}
+		with self._emergency_lock:
+			if self.emergency_job is not None:
+				self.emergency_job.cancel()
+				self.emergency_job = None
 
 
 
@@ -79,83 +216,283 @@ class CrazyflieModule(OscModule):
 
 		"""
 		drone_id = int(path_args['drone_id'])
-		self._debug('adding drone', drone_id, 'at url', radio_url)
-		if drone_id not in self.server.drones:
-			cf = Crazyflie()
-
-			self.server.drones[drone_id] = {
-				'radio_url': radio_url,
-				'cf': cf,
-				'connected': False,
-				'goal': None,
-				'emergency': False,
-			}
+		self._connect_drone(drone_id, radio_url)
 
 
-			send_link_quality_osc_stop = None
+	def osc_connect_many(self, address, *args):
+		"""
+		Adds and connects many drones at once. Connections run concurrently,
+		at most connect_per_radio at a time through each radio.
 
-			# connection callback
-			def on_connection(uri):
-				self._debug('drone', drone_id, 'connected')
-				self.server.drones[drone_id]['connected'] = True
-				(self.server.drones[drone_id]['cf'].param.set_value('flightmode.posSet', '1'))
+		OSC listen: /connect_many
 
-				# Send LPS nodes positions to the drone
-				if self.server.get_module('LPS'):
-					self.osc_update_lps_pos('',
-						drones=drone_id,
-						nodes='*')
+		:param drones: (drone_id, radio_url) pairs, flattened.
+		:type drones: [int, str, int, str...].
 
-				# init param module for this drone
-				if self.server.get_module('PARAM'):
-					self.server.get_module('PARAM').add_param_cb(drone_id)
+		OSC send: /connect_many/done (json) when every drone is ready or failed.
+		"""
+		if len(args) % 2 != 0:
+			self._error('connect_many expects (drone_id, radio_url) pairs')
+			return
+		drones = [(int(drone_id), str(radio_url)) for drone_id, radio_url in zip(args[::2], args[1::2])]
+		self._debug('connecting', len(drones), 'drones,', self.connect_per_radio, 'per radio')
 
-				# Add default loggings for this drone
-				if self.server.get_module('LOG'):
-					self.server.get_module('LOG').add_default_loggers(drone_id)
+		def on_done(results):
+			self._debug('connect_many done:', len(results), 'drones')
+			self._send_chunked('/connect_many/done', json.dumps(results))
 
-				# Start sending link quality at a given rate
-				link_quality = 0
-				def interval_link_quality():
-						nonlocal link_quality
-						self._send('/{}/{}'.format(drone_id, 'link_quality'), link_quality)
-				nonlocal send_link_quality_osc_stop
-				send_link_quality_osc_stop = set_interval(interval_link_quality, 0.1) # 10Hz
-				def on_link_quality(quality):
-						nonlocal link_quality
-						link_quality = quality
-				cf.link_quality_updated.add_callback(on_link_quality)
+		batch = ConnectionBatch(drones, self.connect_per_radio,
+			lambda drone_id, radio_url: self._connect_drone(drone_id, radio_url, batch),
+			on_done)
+		batch.start()
 
-				self._send('/{}/{}'.format(drone_id, 'connection'), True)
 
+	def _connect_drone(self, drone_id, radio_url, batch=None):
+		"""
+		Adds the drone if needed, then opens its link.
+		Returns False if it is already connected.
+		"""
+		self._debug('adding drone', drone_id, 'at url', radio_url)
+		if drone_id not in self.server.drones:
+			self._add_drone(drone_id, radio_url)
 
-			def on_connection_failed(uri, message):
-				self._error('connection to drone', drone_id, 'failed:', message)
+		drone = self.server.drones[drone_id]
+		if drone['connected']:
+			self._error('drone', drone_id, 'already added and connected')
+			return False
 
-				self._send('/{}/{}'.format(drone_id, 'connection'), False)
+		drone['batch'] = batch
+		drone['timings'] = {}
+		drone['toc_fetches'] = []
+		drone['toc_views'] = {}
+		drone['opened_at'] = drone['phase_start'] = time.monotonic()
+		drone['cf'].open_link(radio_url)
+		return True
 
-			def on_disconnection(uri):
-				self._error('Drone', drone_id, 'disconnected')
-				if drone_id in self.server.drones:
-					self.server.drones[drone_id]['connected'] = False
 
-				# stop sending link quality
-				nonlocal send_link_quality_osc_stop
-				if send_link_quality_osc_stop is not None:
-					send_link_quality_osc_stop()
+	def _end_phase(self, drone_id, phase):
+		"""
+		Records the duration of a connection phase (link, toc, params, loggers).
+		"""
+		drone = self.server.drones.get(drone_id)
+		if drone is None or drone['phase_start'] is None:
+			return
+		now = time.monotonic()
+		drone['timings'][phase] = now - drone['phase_start']
+		drone['phase_start'] = now
 
-				self._send('/{}/{}'.format(drone_id, 'disconnection'), True)
 
-			# start the connection
-			cf.connected.add_callback(on_connection)
-			cf.connection_failed.add_callback(on_connection_failed)
-			cf.disconnected.add_callback(on_disconnection)
+	def _end_setup_phase(self, drone_id, phase):
+		"""
+		Records the time from the connection to the drone acknowledging a setup phase (see SETUP_PHASES).
+		Setup phases run concurrently.
+		"""
+		drone = self.server.drones.get(drone_id)
+		with self._setup_lock:
+			if drone is None or drone['setup_job'] is None or phase in drone['timings']:
+				return
+			drone['timings'][phase] = time.monotonic() - drone['phase_start']
+			done = all(phase in drone['timings'] for phase in SETUP_PHASES)
+		if done:
+			self._finish_setup(drone_id)
 
 
-		if not self.server.drones[drone_id]['connected']:
-			self.server.drones[drone_id]['cf'].open_link(radio_url)
-		else:
-			self._error('drone', drone_id, 'already added and connected')
+	def _finish_setup(self, drone_id):
+		"""
+		Publishes the timings of a connection once its setup phases are acknowledged, or timed out :
+		link and toc, then params and loggers (from the connection, missing if timed out),
+		total (from the link opening), and tocs_cached (number of TOCs read from the cache).
+		"""
+		drone = self.server.drones.get(drone_id)
+		with self._setup_lock:
+			if drone is None or drone['setup_job'] is None:
+				return
+			drone['setup_job'].cancel()
+			drone['setup_job'] = None
+			timings = dict(drone['timings'], total=time.monotonic() - drone['opened_at'],
+				tocs_cached=sum(hit for _, hit in drone['toc_fetches']))
+		missing = [phase for phase in SETUP_PHASES if phase not in timings]
+		if missing:
+			self._error('drone', drone_id, 'setup timed out:', missing)
+		self._send('/{}/{}'.format(drone_id, 'connection/timings'), json.dumps(timings))
+		self._connection_done(drone_id, timings)
+
+
+	def _connection_done(self, drone_id, result):
+		"""
+		Reports the end of a connection (result is the timings, or an error) to its batch, if any.
+		"""
+		drone = self.server.drones.get(drone_id)
+		if drone is None:
+			return
+		drone['phase_start'] = None
+		with self._setup_lock:
+			setup_job, drone['setup_job'] = drone['setup_job'], None
+		if setup_job is not None:
+			setup_job.cancel()
+		batch, drone['batch'] = drone['batch'], None
+		if batch is not None:
+			batch.release(drone_id)
+			batch.report(drone_id, result)
+
+
+	def _add_drone(self, drone_id, radio_url):
+		cf = Crazyflie()
+
+		self.server.drones[drone_id] = {
+			'radio_url': radio_url,
+			'cf': cf,
+			'connected': False,
+			# every radio command of the drone goes through this queue
+			'radio': RadioCommandQueue('radio-{}'.format(drone_id)),
+			'link_quality': 0,
+			'link_degraded': False,
+			'link_quality_job': None,
+			# connection in progress
+			'batch': None,
+			'timings': {},
+			'opened_at': None,
+			'phase_start': None,
+			# timeout of the setup phases, while they run
+			'setup_job': None,
+			# (crc, cache hit) of the log then param TOCs of the connection
+			'toc_fetches': [],
+			# TocViews of the connection (see toc_cache.drone_toc_view)
+			'toc_views': {},
+		}
+		# cflib gives each Crazyflie its own TocCache : use the server one, shared by all drones
+		drone = self.server.drones[drone_id]
+		cf._toc_cache = self.server.toc_cache.for_drone(
+			lambda crc, hit: drone['toc_fetches'].append((crc, hit)))
+		self.server.drones[drone_id]['radio'].start()
+		# goals and emergency flags live in the swarm arrays
+		self.server.swarm.add(drone_id)
+
+
+		def on_link_established(uri):
+			self._end_phase(drone_id, 'link')
+
+		# cflib calls it with the value the drone replied, to a read or to our write
+		def on_pos_set(name, value):
+			if value == '1':
+				self._end_setup_phase(drone_id, 'params')
+
+		# connection callback (called once the TOCs are downloaded)
+		def on_connection(uri):
+			self._debug('drone', drone_id, 'connected')
+			drone = self.server.drones[drone_id]
+			self._end_phase(drone_id, 'toc')
+			# the radio is free for the next connection of the batch
+			if drone['batch'] is not None:
+				drone['batch'].release(drone_id)
+
+			drone['connected'] = True
+			self.server.swarm.set_connected(drone_id, True)
+			with self._setup_lock:
+				drone['setup_job'] = self.server.scheduler.once(CONNECTION_SETUP_TIMEOUT,
+					partial(self._finish_setup, drone_id), name='setup/{}'.format(drone_id))
+			drone['radio'].push(PRIORITY_PARAM,
+				partial(cf.param.set_value, 'flightmode.posSet', '1'))
+
+			# Send LPS nodes positions to the drone
+			if self.server.get_module('LPS'):
+				self.osc_update_lps_pos('',
+					drones=drone_id,
+					nodes='*')
+
+			# init param module for this drone
+			if self.server.get_module('PARAM'):
+				self.server.get_module('PARAM').add_param_cb(drone_id)
+
+			# Add default loggings for this drone
+			log_module = self.server.get_module('LOG')
+			if log_module:
+				log_module.when_started(drone_id, log_module.add_default_loggers(drone_id),
+					partial(self._end_setup_phase, drone_id, 'loggers'))
+			else:
+				self._end_setup_phase(drone_id, 'loggers')
+
+			# Start sending link quality at a given rate
+			self._schedule_link_quality(drone_id)
+
+			self._send('/{}/{}'.format(drone_id, 'connection'), True)
+
+
+		def on_connection_failed(uri, message):
+			self._error('connection to drone', drone_id, 'failed:', message)
+			self._connection_done(drone_id, {'error': str(message)})
+
+			self._send('/{}/{}'.format(drone_id, 'connection'), False)
+
+		def on_disconnection(uri):
+			self._error('Drone', drone_id, 'disconnected')
+			self._connection_done(drone_id, {'error': 'disconnected'})
+			if drone_id in self.server.drones:
+				self.server.drones[drone_id]['connected'] = False
+			self.server.swarm.set_connected(drone_id, False)
+
+			# stop sending link quality
+			drone = self.server.drones.get(drone_id)
+			if drone is not None and drone['link_quality_job'] is not None:
+				drone['link_quality_job'].cancel()
+				drone['link_quality_job'] = None
+
+			self._send('/{}/{}'.format(drone_id, 'disconnection'), True)
+
+		# (callbacks are called by cflib threads, the engine decides where they run)
+		marshal = self.server.engine.marshal
+		cf.link_established.add_callback(marshal(on_link_established))
+		cf.connected.add_callback(marshal(on_connection))
+		cf.param.add_update_callback(group='flightmode', name='posSet', cb=marshal(on_pos_set))
+		cf.connection_failed.add_callback(marshal(on_connection_failed))
+		cf.disconnected.add_callback(marshal(on_disconnection))
+		cf.link_quality_updated.add_callback(marshal(partial(self._on_link_quality, drone_id)))
+
+
+	def _schedule_link_quality(self, drone_id):
+		drone = self.server.drones[drone_id]
+		if drone['link_quality_job'] is not None:
+			drone['link_quality_job'].cancel()
+		topic = '/{}/{}'.format(drone_id, 'link_quality')
+		period = LINK_QUALITY_PERIOD * (DEGRADED_SLOWDOWN if drone['link_degraded'] else 1)
+		def publish():
+			self._send(topic, drone['link_quality'])
+			# a stalled link may not report its quality anymore : its backlog still counts
+			self._on_link_quality(drone_id, drone['link_quality'])
+		drone['link_quality_job'] = self.server.scheduler.every(period, publish,
+			priority=PRIORITY_LOW, name='link_quality/{}'.format(drone_id))
+
+
+	def _on_link_quality(self, drone_id, quality):
+		drone = self.server.drones.get(drone_id)
+		if drone is None:
+			return
+		drone['link_quality'] = quality
+		# packets accepted for this link and not sent yet
+		outstanding = drone['radio'].outstanding()
+		# hysteresis : do not flap around a single threshold
+		if not drone['link_degraded'] and (quality < LINK_DEGRADED_QUALITY
+				or outstanding > LINK_DEGRADED_OUTSTANDING):
+			self._set_link_degraded(drone_id, True)
+		elif drone['link_degraded'] and (quality > LINK_RESTORED_QUALITY
+				and outstanding <= LINK_RESTORED_OUTSTANDING):
+			self._set_link_degraded(drone_id, False)
+
+
+	def _set_link_degraded(self, drone_id, degraded):
+		"""
+		Slows down (or restores) the optional traffic of a drone, when its link quality changes.
+		"""
+		drone = self.server.drones[drone_id]
+		drone['link_degraded'] = degraded
+		self._debug('drone', drone_id, 'link', 'degraded' if degraded else 'restored',
+			'(quality', drone['link_quality'], ', outstanding', drone['radio'].outstanding(), ')')
+
+		if drone['link_quality_job'] is not None:
+			self._schedule_link_quality(drone_id)
+		if self.server.get_module('LOG'):
+			self.server.get_module('LOG').set_period_factor(drone_id, DEGRADED_SLOWDOWN if degraded else 1)
+		self._send('/{}/{}'.format(drone_id, 'link_degraded'), degraded)
 
 
 	@drone_connected
@@ -180,7 +517,66 @@ class CrazyflieModule(OscModule):
 		"""
 
 		drone_id = int(path_args['drone_id'])
-		self.server.drones[drone_id]['goal'] = (x, y, z, yaw)
+		try:
+			goal = np.array((x, y, z, yaw), dtype=float)
+		except (TypeError, ValueError) as e:
+			self._error('bad goal for drone', drone_id, ':', e)
+			return
+		if not np.isfinite(goal).all():
+			self._error('bad goal for drone', drone_id, ': not finite', goal.tolist())
+			return
+		self._cancel_trajectories(drone_id)
+		self.server.swarm.set_goal(drone_id, goal)
+
+	def osc_swarm_goals(self, address, *blobs):
+		"""
+		Sets the goals of many drones in one message. They are applied atomically.
+		Goals of drones not connected are dropped (and reported as an error).
+
+		OSC listen: /swarm/goals
+
+		:param goals: a blob of packed big-endian (int32 id, float32 x, y, z, yaw) records,
+			or 5 blobs : the int32 ids, then the float32 xs, ys, zs and yaws.
+		:type goals: blob.
+
+		"""
+
+		try:
+			drone_ids, goals = parse_goals(*blobs)
+		except ValueError as e:
+			self._error('bad swarm goals:', e)
+			return
+
+		# like /{drone_id}/goal : a goal set before the connection would be flown as soon as it connects
+		drones = self.server.drones
+		connected = np.fromiter((drone_id in drones and drones[drone_id]['connected']
+			for drone_id in drone_ids.tolist()), dtype=bool, count=len(drone_ids))
+		if not connected.all():
+			self._error('swarm goals for drones not connected', drone_ids[~connected].tolist())
+			drone_ids, goals = drone_ids[connected], goals[connected]
+
+		if self.trajectories or self.onboard_trajectories:
+			for drone_id in drone_ids.tolist():
+				self._cancel_trajectories(drone_id)
+		try:
+			unknown = self.server.swarm.set_goals(drone_ids, goals)
+		except ValueError as e:
+			self._error('bad swarm goals:', e)
+			return
+		if len(unknown):
+			self._error('swarm goals for unknown drones', unknown.tolist())
+
+	def osc_send_swarm_state(self, address, *args):
+		"""
+		Sends the state (connected, emergency, goal, position, rate, onboard) of every drone as JSON.
+
+		OSC listen: /swarm/send_state
+
+		OSC publish: /swarm/state -> json (chunked when large, see ClientModule)
+		"""
+		state = {str(drone_id): drone_state for drone_id, drone_state in self.server.swarm.dump().items()}
+		self._send_chunked('/swarm/state', json.dumps(state))
+
 
 	@drone_connected
 	def osc_reset_goal(self, address, *args, **path_args):
@@ -192,7 +588,230 @@ class CrazyflieModule(OscModule):
 		"""
 
 		drone_id = int(path_args['drone_id'])
-		self.server.drones[drone_id]['goal'] = None
+		self._cancel_trajectories(drone_id)
+		self.server.swarm.clear_goal(drone_id)
+
+
+	def _cancel_trajectories(self, drone_id):
+		"""
+		Stops following the server side trajectory, and gives the drone back to the goal stream
+		if it was flying an onboard one.
+		"""
+		self.trajectories.pop(drone_id, None)
+		onboard = self.onboard_trajectories.get(drone_id)
+		if onboard is not None and onboard['job'] is not None:
+			onboard['job'].cancel()
+			onboard['job'] = None
+		self.server.swarm.set_onboard(drone_id, False)
+
+
+	def _parse_trajectory(self, drone_id, args, interpolation):
+		if args and isinstance(args[-1], str):
+			interpolation = args[-1]
+			args = args[:-1]
+		data = args[0] if len(args) == 1 and not isinstance(args[0], (int, float)) else args
+
+		try:
+			return Trajectory(parse_waypoints(data), interpolation)
+		except ValueError as e:
+			self._error('bad trajectory for drone', drone_id, ':', e)
+			return None
+
+
+	@drone_connected
+	def osc_trajectory(self, address, *args, **path_args):
+		"""
+		Makes the drone with ID {drone_id} follow a timed waypoint trajectory, starting now.
+		The server interpolates it and sends the setpoints at the drone rate (see /{drone_id}/rate).
+
+		OSC listen: /{drone_id}/trajectory
+
+		:param waypoints: a blob of packed big-endian float32 (t, x, y, z, yaw) records,
+			or the same values as separate floats. t is in seconds.
+		:type waypoints: blob or float[].
+
+		:param interpolation: optional. 'linear' (default) or 'cubic'.
+		:type interpolation: str.
+
+		"""
+
+		drone_id = int(path_args['drone_id'])
+		trajectory = self._parse_trajectory(drone_id, args, 'linear')
+		if trajectory is None:
+			return
+
+		self._debug('drone', drone_id, 'following a', '{:.1f}s'.format(trajectory.duration),
+			trajectory.interpolation, 'trajectory')
+		self._cancel_trajectories(drone_id)
+		self.trajectories[drone_id] = (trajectory, time.monotonic())
+
+
+	@drone_exists
+	def osc_stop_trajectory(self, address, *args, **path_args):
+		"""
+		Stops the trajectory (server side or onboard) of the drone with ID {drone_id}.
+		It then holds its current goal, or after an onboard trajectory its last known position
+		(or without one, the point of the trajectory it was flying to).
+
+		OSC listen: /{drone_id}/trajectory/stop
+
+		"""
+
+		drone_id = int(path_args['drone_id'])
+		onboard = self.onboard_trajectories.get(drone_id)
+		if onboard is not None and onboard['job'] is not None:
+			position = self.server.swarm.position[self.server.swarm.slots[drone_id]]
+			if np.isnan(position).any():
+				# position unknown : hover where the uploaded pieces were taking it
+				# (never hlc.stop(), which cuts the motors)
+				elapsed = (time.monotonic() - onboard['started']) / onboard['time_scale']
+				point = evaluate_poly4d(onboard['durations'], onboard['coefficients'], elapsed)
+				self.server.swarm.set_goal(drone_id, self.server.swarm.from_drone_frame([point])[0])
+			else:
+				# the position is telemetry, in the drones frame
+				goal = self.server.swarm.from_drone_frame([tuple(position) + (0,)])[0]
+				goal[3] = onboard['end'][3]
+				self.server.swarm.set_goal(drone_id, goal)
+		self._cancel_trajectories(drone_id)
+
+
+	@drone_connected
+	def osc_upload_trajectory(self, address, *args, **path_args):
+		"""
+		Compiles a timed waypoint trajectory into polynomial pieces and uploads them
+		to the trajectory memory of the drone with ID {drone_id}, to be flown by its
+		high level commander (see /{drone_id}/trajectory/start).
+		Only start and stop commands then go through the radio.
+
+		OSC listen: /{drone_id}/trajectory/upload
+
+		:param waypoints: a blob of packed big-endian float32 (t, x, y, z, yaw) records,
+			or the same values as separate floats. t is in seconds.
+		:type waypoints: blob or float[].
+
+		:param interpolation: optional. 'cubic' (default) or 'linear'.
+		:type interpolation: str.
+
+		OSC send: /{drone_id}/trajectory/uploaded (duration) when the drone is ready to fly it.
+		"""
+
+		drone_id = int(path_args['drone_id'])
+		cf = self.server.drones[drone_id]['cf']
+		hlc = getattr(cf, 'high_level_commander', None)
+		memories = cf.mem.get_mems(MemoryElement.TYPE_TRAJ) if Poly4D is not None else []
+		if hlc is None or not memories:
+			self._error('drone', drone_id, 'has no high level commander or trajectory memory')
+			return
+
+		trajectory = self._parse_trajectory(drone_id, args, 'cubic')
+		if trajectory is None:
+			return
+		if len(trajectory.times) < 2:
+			self._error('trajectory for drone', drone_id, 'needs at least 2 waypoints')
+			return
+		# the drone flies in its own frame : transform the waypoints like the goals
+		waypoints = np.column_stack((trajectory.times, self.server.swarm.to_drone_frame(trajectory.points)))
+		durations, coefficients = Trajectory(waypoints, trajectory.interpolation).poly4d()
+
+		# the waypoints are clamped in the geofence, but cubic pieces can overshoot between them
+		minimum, maximum = poly4d_bounds(durations, coefficients)
+		geofence_min, geofence_max = self.server.swarm.geofence()
+		if np.any(minimum < geofence_min - 1e-6) or np.any(maximum > geofence_max + 1e-6):
+			self._error('trajectory of drone', drone_id, 'leaves the geofence between waypoints',
+				'(reaches', minimum.tolist(), maximum.tolist(), ') : add waypoints or use linear interpolation')
+			return
+
+		memory = memories[0]
+		if len(durations) * POLY4D_PIECE_SIZE > memory.size:
+			self._error('trajectory too long for drone', drone_id, ':', len(durations), 'pieces, max',
+				memory.size // POLY4D_PIECE_SIZE)
+			return
+
+		self._cancel_trajectories(drone_id)
+		self.onboard_trajectories.pop(drone_id, None)
+		memory.poly4Ds = [Poly4D(float(duration), *(Poly4D.Poly(piece.tolist()) for piece in polys))
+			for duration, polys in zip(durations, coefficients)]
+
+		radio = self.server.drones[drone_id]['radio']
+		def on_written(memory, address):
+			radio.push(PRIORITY_TOC, partial(hlc.define_trajectory, ONBOARD_TRAJECTORY_ID, 0, len(durations)))
+			self.onboard_trajectories[drone_id] = {
+				'duration': trajectory.duration,
+				'end': trajectory.points[-1],
+				# the uploaded pieces, in the drone frame
+				'durations': durations,
+				'coefficients': coefficients,
+				'started': None,
+				'time_scale': 1.0,
+				'job': None,
+			}
+			self._debug('drone', drone_id, 'trajectory uploaded:', len(durations), 'pieces')
+			self._send('/{}/trajectory/uploaded'.format(drone_id), float(trajectory.duration))
+
+		self._debug('uploading a', '{:.1f}s'.format(trajectory.duration), 'trajectory to drone', drone_id)
+		if 'commander' in cf.param.toc.toc and 'enHighLevel' in cf.param.toc.toc['commander']:
+			radio.push(PRIORITY_PARAM, partial(cf.param.set_value, 'commander.enHighLevel', '1'))
+		# a bulk memory write : after the flight critical commands
+		radio.push(PRIORITY_TOC, partial(memory.write_data, self.server.engine.marshal(on_written)))
+
+
+	@drone_connected
+	def osc_start_trajectory(self, address, time_scale=1.0, **path_args):
+		"""
+		Makes the drone with ID {drone_id} fly its uploaded trajectory (see /{drone_id}/trajectory/upload).
+		No setpoints are sent to it until the end of the trajectory, when it holds the last waypoint.
+
+		OSC listen: /{drone_id}/trajectory/start
+
+		:param time_scale: optional. > 1 flies slower, < 1 faster (default 1).
+		:type time_scale: float.
+
+		"""
+
+		drone_id = int(path_args['drone_id'])
+		onboard = self.onboard_trajectories.get(drone_id)
+		if onboard is None:
+			self._error('no trajectory uploaded to drone', drone_id)
+			return
+
+		self._cancel_trajectories(drone_id)
+		drone = self.server.drones[drone_id]
+		drone['radio'].push(PRIORITY_SETPOINT, partial(drone['cf'].high_level_commander.start_trajectory,
+			ONBOARD_TRAJECTORY_ID, time_scale=float(time_scale)))
+		self.server.swarm.set_onboard(drone_id, True)
+		onboard['started'] = time.monotonic()
+		onboard['time_scale'] = float(time_scale)
+
+		def on_done():
+			onboard['job'] = None
+			self.server.swarm.set_goal(drone_id, onboard['end'])
+			self.server.swarm.set_onboard(drone_id, False)
+			self._send('/{}/trajectory/done'.format(drone_id), True)
+		onboard['job'] = self.server.scheduler.once(onboard['duration'] * float(time_scale), on_done,
+			name='trajectory/{}'.format(drone_id))
+
+
+	@drone_exists
+	def osc_set_rate(self, address, rate, **path_args):
+		"""
+		Sets the rate at which setpoints are sent to the drone with ID {drone_id}.
+
+		OSC listen: /{drone_id}/rate
+
+		:param rate: setpoints per second (default 10, max 100).
+		:type rate: float.
+
+		"""
+
+		drone_id = int(path_args['drone_id'])
+		rate = float(rate)
+		if not 0 < rate <= MAX_RATE:
+			self._error('rate must be in ]0,', MAX_RATE, '] Hz, got', rate)
+			return
+
+		self._debug('drone', drone_id, 'setpoint rate set to', rate, 'Hz')
+		self.server.swarm.set_rate(drone_id, rate)
+		self._update_rate_jobs()
 
 
 	@drone_exists
@@ -204,6 +823,9 @@ class CrazyflieModule(OscModule):
 
 		"""
 		drone_id = int(path_args['drone_id'])
+		self._connection_done(drone_id, {'error': 'removed'})
+		# drop the waiting commands, then cut engines directly
+		self.server.drones[drone_id]['radio'].stop()
 		if self.server.drones[drone_id]['connected']:
 			# cut engines
 			self.server.drones[drone_id]['cf'].commander.send_stop_setpoint()
@@ -211,10 +833,13 @@ class CrazyflieModule(OscModule):
 			self.server.drones[drone_id]['cf'].close_link()
 		# remove
 		del self.server.drones[drone_id]
+		self._cancel_trajectories(drone_id)
+		self.onboard_trajectories.pop(drone_id, None)
+		self.server.swarm.remove(drone_id)
+		self._update_rate_jobs()
 
 
-	@multi_drones
-	@drone_exists
+	@osc_requires('CRAZYFLIE')
 	def osc_emergency(self, address, *args, **path_args):
 		"""
 		Sends an emergency signal to drones {drones}.
@@ -225,10 +850,148 @@ class CrazyflieModule(OscModule):
 
 		"""
 
-		drone_id = int(path_args['drone_id'])
-		self._debug('Emergency on drone', drone_id)
+		received_at = receive_time()
+		drones = str(path_args['drones'])
+		selected = list(self.server.drones.keys()) if drones == '*' else drones.split(';')
+		drone_ids = []
+		# a malformed id must not keep the other drones from stopping
+		for drone_id in selected:
+			try:
+				drone_id = int(drone_id)
+			except ValueError:
+				self._error('bad drone id in emergency :', repr(drone_id))
+				continue
+			if drone_id in self.server.drones:
+				drone_ids.append(drone_id)
+			else:
+				self._error('drone not found :', drone_id)
+		self._debug('Emergency on drones', drone_ids)
+		self.emergency_stop(drone_ids, received_at)
+
+
+	def emergency_stop(self, drone_ids, received_at=None):
+		"""
+		Sends stop setpoints to drone_ids right away, ahead of any other radio command,
+		then repeats them at high priority during EMERGENCY_REPEAT_PERIOD.
+
+		:param received_at: optional. The time.monotonic() at which the emergency was requested,
+			to measure the request to radio latency.
+		:type received_at: float.
+		"""
+		requested_at = received_at if received_at is not None else time.monotonic()
+		for drone_id in drone_ids:
+			self.server.swarm.set_emergency(drone_id)
+			self._cancel_trajectories(drone_id)
+		self._send_stop_setpoints(drone_ids, requested_at)
+
+		with self._emergency_lock:
+			self.emergencies += 1
+			until = time.monotonic() + EMERGENCY_REPEAT_PERIOD
+			for drone_id in drone_ids:
+				self.emergency_repeats[drone_id] = until
+			if self.emergency_job is None and self.emergency_repeats:
+				self.emergency_job = self.server.scheduler.every(EMERGENCY_REPEAT_INTERVAL,
+					self._repeat_stop_setpoints, priority=PRIORITY_HIGH, name='emergency')
+
+
+	def _repeat_stop_setpoints(self):
+		now = time.monotonic()
+		with self._emergency_lock:
+			for drone_id, until in list(self.emergency_repeats.items()):
+				if until <= now:
+					del self.emergency_repeats[drone_id]
+			drone_ids = list(self.emergency_repeats)
+			if not drone_ids and self.emergency_job is not None:
+				self.emergency_job.cancel()
+				self.emergency_job = None
+		self._send_stop_setpoints(drone_ids)
+
+
+	def _send_stop_setpoints(self, drone_ids, requested_at=None):
+		"""
+		Queues stop setpoints before any other command of drone_ids (waiting setpoints are dropped).
+		"""
+		for drone_id in drone_ids:
+			drone = self.server.drones.get(drone_id)
+			if drone is None or not drone['connected']:
+				continue
+			drone['radio'].discard(PRIORITY_SETPOINT)
+			drone['radio'].push(PRIORITY_EMERGENCY,
+				partial(self._send_stop_setpoint, drone_id, drone['cf'], requested_at),
+				key=None if requested_at is not None else 'emergency_repeat')
+
+
+	def _send_stop_setpoint(self, drone_id, cf, requested_at):
+		try:
+			cf.commander.send_stop_setpoint()
+		except Exception as e:
+			self._error('emergency stop of drone', drone_id, 'failed:', e)
+			return
+		with self._emergency_lock:
+			self.emergency_stops_sent += 1
+			if requested_at is not None:
+				latency = time.monotonic() - requested_at
+				count, total, maximum, _ = self.emergency_latencies
+				self.emergency_latencies = [count + 1, total + latency, max(maximum, latency), latency]
+
+
+	def emergency_stats(self):
+		with self._emergency_lock:
+			count, total, maximum, last = self.emergency_latencies
+			return {
+				'emergencies': self.emergencies,
+				'stops_sent': self.emergency_stops_sent,
+				'repeating': len(self.emergency_repeats),
+				'last_latency_ms': 1000 * last,
+				'mean_latency_ms': 1000 * total / count if count else 0,
+				'max_latency_ms': 1000 * maximum,
+			}
+
+
+	def osc_set_geofence(self, address, x_min, y_min, z_min, x_max, y_max, z_max):
+		"""
+		Sets the box every goal is clamped in (default: z >= 0).
+
+		OSC listen: /geofence
+
+		:param x_min: the minimum X position.
+		:type x_min: float.
+		:param y_min: the minimum Y position.
+		:type y_min: float.
+		:param z_min: the minimum Z position.
+		:type z_min: float.
+		:param x_max: the maximum X position.
+		:type x_max: float.
+		:param y_max: the maximum Y position.
+		:type y_max: float.
+		:param z_max: the maximum Z position.
+		:type z_max: float.
+
+		"""
+
+		self._debug('geofence set to', (x_min, y_min, z_min), (x_max, y_max, z_max))
+		self.server.swarm.set_geofence((x_min, y_min, z_min), (x_max, y_max, z_max))
+
+
+	def osc_set_frame_offset(self, address, x, y, z, yaw):
+		"""
+		Sets the offset added to every goal to go from the clients frame to the drones frame.
+
+		OSC listen: /frame_offset
+
+		:param x: the X offset.
+		:type x: float.
+		:param y: the Y offset.
+		:type y: float.
+		:param z: the Z offset.
+		:type z: float.
+		:param yaw: the yaw offset.
+		:type yaw: float.
+
+		"""
 
-		self.server.drones[drone_id]['emergency'] = True
+		self._debug('frame offset set to', (x, y, z, yaw))
+		self.server.swarm.set_frame_offset((x, y, z, yaw))
 
 
 	def get_connected_drones(self):
@@ -264,12 +1027,12 @@ class CrazyflieModule(OscModule):
 		self._debug('Updating lps node', node_id, 'position in drone', drone_id)
 
 		param_module = self.server.get_module('PARAM')
-		param_module.osc_set_param(None,
+		param_module.osc_set_param(None, drones=drone_id,
 			param_group='anchorpos', param_name='anchor'+str(node_id)+'x',
-			value=self.server.lps_positions[node_id][0], **path_args)
-		param_module.osc_set_param(None,
+			value=self.server.lps_positions[node_id][0])
+		param_module.osc_set_param(None, drones=drone_id,
 			param_group='anchorpos', param_name='anchor'+str(node_id)+'y',
-			value=self.server.lps_positions[node_id][1], **path_args)
-		param_module.osc_set_param(None,
+			value=self.server.lps_positions[node_id][1])
+		param_module.osc_set_param(None, drones=drone_id,
 			param_group='anchorpos', param_name='anchor'+str(node_id)+'z',
-			value=self.server.lps_positions[node_id][2], **path_args)
+			value=self.server.lps_positions[node_id][2])
@@ -1,16 +1,24 @@
 from .OscModule import OscModule
 from .osc_validators import *
+from .toc_cache import drone_toc_view
+from .radio_queue import PRIORITY_LOG
 from cflib.crazyflie.log import LogConfig
 from cflib.crazyflie import Crazyflie
 import cflib
 import json
+import threading
 
 class Logger(object):
 
+	# log periods are sent in 10ms units, on one byte
+	MAX_PERIOD_MS = 2550
+
 	def __init__(self, log):
 		self.log = log
 		self.variables = []
 		self.started = False
+		self.period_in_ms = log.period_in_ms
+		self.period_factor = 1
 
 	def add_variable(self, var, var_type):
 		self.variables.append(var)
@@ -22,10 +30,25 @@ class Logger(object):
 	def add_error_callback(self, callback):
 		self.log.error_cb.add_callback(callback)
 
+	def add_started_callback(self, callback):
+		# called by cflib with (log, started) once the drone acknowledged (or refused) the start
+		self.log.started_cb.add_callback(callback)
+
 	def start(self):
 		self.started = True
+		period_in_ms = min(self.period_in_ms * self.period_factor, self.MAX_PERIOD_MS)
+		# LogConfig only converts period_in_ms to period in its constructor, and start() sends period
+		self.log.period_in_ms = period_in_ms
+		self.log.period = int(period_in_ms / 10)
 		self.log.start()
 
+	def restart(self):
+		"""
+		Restarts the log, to apply a new period factor.
+		"""
+		self.log.stop()
+		self.start()
+
 
 class LogModule(OscModule):
 	"""
@@ -33,7 +56,7 @@ class LogModule(OscModule):
 
 	OSC publish :
 
-	/{drone_id}/toc -> json
+	/{drone_id}/toc -> json (chunked when large, see ClientModule)
 
 	/{drone_id}/toc/{toc_variable} -> str[]
 
@@ -151,21 +174,22 @@ class LogModule(OscModule):
 		"""
 		drone_id = int(path_args['drone_id'])
 		log_name = str(path_args['log_name'])
-		logger = self.server.drones[drone_id]['logs'][log_name]
-
-		self.server.drones[drone_id]['cf'].log.add_config(logger.log)
+		drone = self.server.drones[drone_id]
+		logger = drone['logs'][log_name]
 
 		logger.add_data_received_callback(
-			self._on_log_received(drone_id, log_name))
+			self.server.engine.marshal(self._on_log_received(drone_id, log_name)))
 		logger.add_error_callback(self._error)
 
-		logger.start()
+		def start_logger():
+			drone['cf'].log.add_config(logger.log)
+			logger.start()
+		logger.started = True
+		drone['radio'].push(PRIORITY_LOG, start_logger)
 
 
 	def _get_toc(self, drone_id):
-		toc = self.server.drones[drone_id]['cf'].log.toc.toc.items()
-		toc = {key: sorted([v for v in value]) for key, value in toc}
-		return toc
+		return drone_toc_view(self.server, drone_id, 'log')
 
 
 	@multi_drones
@@ -185,9 +209,9 @@ class LogModule(OscModule):
 		drone_id = int(path_args['drone_id'])
 		toc_variable = str(path_args['toc_variable'])
 
-		toc = self._get_toc(drone_id)
+		toc = self._get_toc(drone_id).groups
 		if toc_variable in toc:
-			self._send('/'.join([drone_id, toc_variable]), toc[toc_variable])
+			self._send('/'.join([str(drone_id), toc_variable]), toc[toc_variable])
 
 
 	@multi_drones
@@ -203,34 +227,40 @@ class LogModule(OscModule):
 
 		"""
 
-		print(address)
-
 		drone_id = int(path_args['drone_id'])
-
-		toc = self._get_toc(drone_id)
-
-		self._send('/'+str(drone_id)+'/toc', json.dumps(toc))
+		self._send_chunked('/'+str(drone_id)+'/toc', self._get_toc(drone_id).json)
 
 	def _on_log_received(self, drone_id, log_name):
 		log_name = str(log_name)
 		drone_id = int(drone_id)
 
 		logger = self.server.drones[drone_id]['logs'][log_name]
+		# variables cannot change once started : build the topics once
+		log_topic = '/'.join([str(drone_id), log_name])
+		variable_topics = {var: '/'.join([log_topic, var]) for var in logger.variables}
 		def callback(log_id, log_content, log_object):
 			# send each variable on /{drone_id}/{log_name}/{variable}
 			for var, value in log_content.items():
-				self._send('/'.join([str(drone_id), log_name, var]),
+				self._send(variable_topics.get(var) or '/'.join([log_topic, var]),
 					value)
 			# send a json on /{drone_id}/{log_name}
 
 #			self._debug('Log', log_name, 'received :', log_content)
 
-			self._send('/'.join([str(drone_id), log_name]),
-				[log_content[var] for var in logger.variables])
+			values = [log_content[var] for var in logger.variables]
+			self._send(log_topic, values)
+
+			if log_name == 'position':
+				self.server.swarm.set_position(drone_id, values)
 
 		return callback
 
 	def add_default_loggers(self, drone_id):
+		"""
+		Adds and starts the position, battery and rpy loggers of a drone.
+
+		:returns: the names of the default loggers.
+		"""
 		drone_id = int(drone_id)
 
 		# position -> x y z
@@ -272,4 +302,52 @@ class LogModule(OscModule):
 		self.osc_log_start('',
 			drones=drone_id,
 			log_name='rpy')
+		return ['position', 'battery', 'rpy']
+
 
+	def when_started(self, drone_id, log_names, callback):
+		"""
+		Calls callback() once the drone acknowledged the start of its loggers log_names
+		(or refused it) : Logger.start() only sends the request.
+		"""
+		drone = self.server.drones[int(drone_id)]
+		logs = drone.get('logs', {})
+		waiting = set(log_name for log_name in log_names if log_name in logs)
+		lock = threading.Lock()
+
+		def on_started(log_name):
+			with lock:
+				if log_name not in waiting:
+					return
+				waiting.discard(log_name)
+				if waiting:
+					return
+			callback()
+
+		if not waiting:
+			callback()
+			return
+		for log_name in list(waiting):
+			logger = logs[log_name]
+			logger.add_started_callback(self.server.engine.marshal(
+				lambda log, started, log_name=log_name: on_started(log_name)))
+			# it may have been acknowledged already
+			if logger.log.started:
+				on_started(log_name)
+
+
+	def set_period_factor(self, drone_id, factor):
+		"""
+		Multiplies the period of every logger of a drone by factor (1 restores them),
+		to leave radio bandwidth to the setpoints when its link degrades.
+		"""
+		drone = self.server.drones.get(int(drone_id))
+		if drone is None or 'logs' not in drone:
+			return
+		for log_name, logger in list(drone['logs'].items()):
+			if logger.period_factor == factor:
+				continue
+			logger.period_factor = factor
+			if logger.started:
+				# the restart applies the latest factor : no need to queue several
+				drone['radio'].push(PRIORITY_LOG, logger.restart, key='period/'+log_name)
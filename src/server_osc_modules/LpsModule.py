@@ -1,7 +1,10 @@
 from .OscModule import OscModule
 from .osc_validators import lps_node_exists, one_drone_is_connected, multi_nodes
+from .radio_queue import PRIORITY_PARAM
 from lpslib.lopoanchor import LoPoAnchor
 
+from functools import partial
+
 class LpsModule(OscModule):
 	"""
 	LpsModule class. Implements OSC routes related to LPS nodes
@@ -18,7 +21,7 @@ class LpsModule(OscModule):
 
 	def routes(self):
 		self.add_route('/set_node_number', self.osc_set_node_number)
-		self.add_route('/{node_id}/set_position', self.osc_set_node_position)
+		self.add_route('/{node_id:int}/set_position', self.osc_set_node_position)
 		self.add_route('/{nodes}/reboot', self.osc_reboot)
 
 	def osc_set_node_number(self, address, number):
@@ -74,13 +77,11 @@ class LpsModule(OscModule):
 			drones_ids, drones = zip(*self.server.get_module('CRAZYFLIE').get_connected_drones())
 
 			anchor = LoPoAnchor(drones[0]['cf'])
-			anchor.set_position(node_id, (x, y, z))
+			drones[0]['radio'].push(PRIORITY_PARAM, partial(anchor.set_position, node_id, (x, y, z)))
 
-			crazyflie_module = self.server.get_module('CRAZYFLIE')
-			for drone_id in drones_ids:
-				crazyflie_module.osc_update_lps_pos('',
-					drones=drone_id,
-					nodes=node_id)
+			self.server.get_module('CRAZYFLIE').osc_update_lps_pos('',
+				drones=';'.join(str(drone_id) for drone_id in drones_ids),
+				nodes=node_id)
 		update_in_drone(self)
 
 
@@ -110,4 +111,5 @@ class LpsModule(OscModule):
 		self._debug('rebooting node', node_id)
 		_, drones = self.server.get_module('CRAZYFLIE').get_connected_drones()
 		anchor = LoPoAnchor(drones[0]['cf'])
-		anchor.reboot(node_id, LoPoAnchor.REBOOT_TO_BOOTLOADER if reboot_bootloader else LoPoAnchor.REBOOT_TO_FIRMWARE)
+		drones[0]['radio'].push(PRIORITY_PARAM, partial(anchor.reboot, node_id,
+			LoPoAnchor.REBOOT_TO_BOOTLOADER if reboot_bootloader else LoPoAnchor.REBOOT_TO_FIRMWARE))
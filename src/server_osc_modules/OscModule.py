@@ -1,32 +1,8 @@
-import re
 import sys
 
-from functools import wraps
-
 from colorama import Fore, Style
 from .osc_validators import osc_requires
 
-def regexed(regex):
-	def decorator(method):
-		@wraps(method)
-		def wrapper(address, *args):
-			# switch every {name} to "(P<name>.*)" in order to make a real regex
-			pattern = re.sub('\{(.+?)\}', '(?P<\\1>.+)', regex)
-			pattern = '^' + pattern + '$'
-			# then match the path to the regex
-			m = re.match(pattern, address)
-			# The python-osc matcher is not perfect so we make it more restrictive here
-			if m is not None:
-				regex_args = m.groupdict()
-				return method(address, *args, **regex_args)
-		return wrapper
-	return decorator
-
-
-def regex_to_topic(regex):
-	return re.sub('\{.+?\}', '*', regex)
-
-
 class OscModule(object):
 
 	@staticmethod
@@ -59,21 +35,31 @@ class OscModule(object):
 		self.dispatcher = None
 
 		self._routes = []
+		self._full_topics = {}
 
 
-	def add_route(self, sub_topic, callback):
+	def add_route(self, sub_topic, callback, signature=None, coalesce=False, urgent=False):
 		"""
 		Add a new route to the server (relative to the module base_topic).
 
 		:param sub_topic: the topic (relative to base_topic) of this route.
+			Path segments like {name} or {name:int} are passed to the callback as keyword arguments.
 		:type sub_topic: str.
 		:param callback: the route handler.
 		:type callback: function.
+		:param signature: optional. OSC type tags of the hot messages of this route (ex: 'ffff'),
+			decoded by the router fast path.
+		:type signature: str.
+		:param coalesce: optional. True if only the latest message of each address matters :
+			a message waiting for a worker is then replaced by a newer one.
+		:type coalesce: bool.
+		:param urgent: optional. True if the messages must never wait behind others nor be dropped :
+			they are then dispatched as soon as they are received (keep their handler short).
+		:type urgent: bool.
 		"""
-		full_topic_regex = self._topic_reg(sub_topic)
-		full_topic = regex_to_topic(full_topic_regex)
-		self.dispatcher.map(full_topic, regexed(full_topic_regex)(callback))
-		self._routes.append(full_topic_regex)
+		full_topic = self._topic_reg(sub_topic)
+		self.dispatcher.add_route(full_topic, callback, signature=signature, coalesce=coalesce, urgent=urgent)
+		self._routes.append(full_topic)
 
 
 	def _debug(self, *args):
@@ -95,15 +81,29 @@ class OscModule(object):
 
 	@osc_requires('CLIENT')
 	def _send(self, topic, data):
-		self.server.get_module('CLIENT').broadcast(self._topic_reg(topic), data)
+		full_topic = self._full_topics.get(topic)
+		if full_topic is None:
+			full_topic = self._full_topics[topic] = self._topic_reg(topic)
+		self.server.get_module('CLIENT').broadcast(full_topic, data)
+
+
+	@osc_requires('CLIENT')
+	def _send_chunked(self, topic, payload):
+		"""
+		Sends a large string payload (ex: JSON) in chunks, see ClientModule.
+		"""
+		full_topic = self._full_topics.get(topic)
+		if full_topic is None:
+			full_topic = self._full_topics[topic] = self._topic_reg(topic)
+		self.server.get_module('CLIENT').broadcast_chunked(full_topic, payload)
 
 
 	def __call__(self, dispatcher):
 		"""
 		Builds the routes of this module.
 
-		:param dispatcher: the python-osc dispatcher.
-		:type dispatcher: Dispatcher.
+		:param dispatcher: the server router.
+		:type dispatcher: OscRouter.
 		"""
 		self.dispatcher = dispatcher
 		self.routes()
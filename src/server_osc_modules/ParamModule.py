@@ -1,17 +1,36 @@
 from .OscModule import OscModule
 from .osc_validators import *
+from .toc_cache import drone_toc_view
+from .radio_queue import PRIORITY_PARAM, PRIORITY_TOC
+from .param_shadow import ParamShadow, ParamSnapshot
+from .osc_scheduler import PRIORITY_LOW
 from cflib.crazyflie import Crazyflie
 import cflib
 import json
+import threading
+import time
+
+from functools import partial
+
+# seconds a snapshot waits for the values of the whole TOC
+SNAPSHOT_TIMEOUT = 5.0
 
 class ParamModule(OscModule):
 	"""ParamModule class. Implements OSC routes related to crazyflie params
 
 	OSC publish :
-	/{drone_id}/toc -> json
+	/{drone_id}/toc -> json (chunked when large, see ClientModule)
 	/{drone_id}/toc/{toc_variable} -> str[]
 	/{drone_id}/{param_group}/{param_name} -> value
 
+	/{drone_id}/{param_group}/{param_name}/cached -> value, age (seconds since the drone sent it)
+
+	/{drone_id}/snapshot -> json {group: {name: value}} (chunked when large, see ClientModule)
+
+	/{drone_id}/snapshot/done -> received, expected, duration
+
+	The last value of each param is kept (see ParamShadow) : writes given a max_age
+	which would not change a param are not sent to the drone.
 	"""
 
 	@staticmethod
@@ -20,18 +39,31 @@ class ParamModule(OscModule):
 
 	def __init__(self, server, base_topic, debug=False):
 		super(ParamModule, self).__init__(server=server, base_topic=base_topic, debug=debug)
+		self.shadows = {} # drone_id -> ParamShadow of the current connection
+		self.snapshots = {} # drone_id -> ParamSnapshot in progress
+		self._snapshots_lock = threading.Lock()
 
 	def routes(self):
 		self.add_route('/{drones}/{param_group}/{param_name}/set', self.osc_set_param)
+		self.add_route('/{drones}/{param_group}/{param_name}/get', self.osc_get_param)
 		self.add_route('/{drones}/send_toc', self.osc_send_toc)
 		self.add_route('/{drones}/send_toc/{toc_variable}', self.osc_send_toc_variable)
 		self.add_route('/{drones}/get_all_values', self.osc_get_all_values)
+		self.add_route('/{drones}/snapshot', self.osc_snapshot)
+
+
+	def start(self):
+		self.server.stats['params'] = self.param_stats
+
+
+	def param_stats(self):
+		return {drone_id: shadow.stats() for drone_id, shadow in list(self.shadows.items())}
 
 
 	@multi_drones
 	@param_exists
 	@drone_connected
-	def osc_set_param(self, address, value,
+	def osc_set_param(self, address, value, max_age=None,
 					**path_args):
 		"""Sets the param named {param_group}.{param_name} in drones {drones}.
 
@@ -47,23 +79,83 @@ class ParamModule(OscModule):
 
 		:param value: the value to set to the param
 		:type value: str.
+
+		:param max_age: optional. Skips the write if the drone sent this value less than max_age seconds ago
+			(the known value is then published, as a confirmation would be), or is being set to it.
+			Always written without it (ex: params the firmware resets by itself).
+		:type max_age: float.
 		"""
 
 		drone_id = int(int(path_args['drone_id']))
 		param_group = str(path_args['param_group'])
 		param_name = str(path_args['param_name'])
-
-		self._debug('setting param', param_group+'.'+param_name,
+		complete_name = param_group+'.'+param_name
+
+		shadow = self.shadows.get(drone_id)
+		if shadow is not None:
+			write, known = shadow.should_write(complete_name, str(value),
+				float(max_age) if max_age is not None else None)
+			if not write:
+				self._debug('param', complete_name, 'of drone', drone_id, 'already set to', str(value))
+				if known is not None:
+					self._send('/'.join([str(drone_id), param_group, param_name]), known)
+				return
+
+		self._debug('setting param', complete_name,
 			'in drone', drone_id, 'to value', str(value))
 
-		self.server.drones[drone_id]['cf'].\
-		param.set_value(param_group+'.'+param_name, str(value))
+		drone = self.server.drones[drone_id]
+		# a newer value of the same param replaces a waiting one (ex: UI sliders)
+		drone['radio'].push(PRIORITY_PARAM,
+			partial(drone['cf'].param.set_value, complete_name, str(value)),
+			key='param/'+complete_name)
+
+
+	@multi_drones
+	@param_exists
+	@drone_connected
+	def osc_get_param(self, address, max_age=None, **path_args):
+		"""Sends the last known value of the param named {param_group}.{param_name} in drones {drones},
+		without waiting for the drone.
+
+		OSC listen: /{drones}/{param_group}/{param_name}/get
+
+		OSC publish: /{drone_id}/{param_group}/{param_name}/cached -> value, age
+
+		:param {drones}: drones ids separated by a ';'. * for all
+		:type {drones}: str.
+
+		:param {param_group}: group of the param to get.
+		:type {param_group}: str.
+		:param {param_name}: name of the param to get.
+		:type {param_name}: str.
+
+		:param max_age: optional. If the value is unknown or older (in seconds),
+			it is also read again from the drone, and published on /{drone_id}/{param_group}/{param_name}.
+		:type max_age: float.
+		"""
+
+		drone_id = int(path_args['drone_id'])
+		param_group = str(path_args['param_group'])
+		param_name = str(path_args['param_name'])
+		complete_name = param_group+'.'+param_name
+
+		shadow = self.shadows.get(drone_id)
+		value, age = shadow.get(complete_name) if shadow is not None else (None, None)
+		if value is not None:
+			self._send('/'.join([str(drone_id), param_group, param_name, 'cached']), [value, float(age)])
+
+		if value is None or (max_age is not None and age > float(max_age)):
+			if shadow is not None:
+				shadow.expect(complete_name)
+			drone = self.server.drones[drone_id]
+			drone['radio'].push(PRIORITY_PARAM,
+				partial(drone['cf'].param.request_param_update, complete_name),
+				key='read/'+complete_name)
 
 
 	def _get_toc(self, drone_id):
-		toc = self.server.drones[drone_id]['cf'].param.toc.toc.items()
-		toc = {key: sorted([v for v in value]) for key, value in toc}
-		return toc
+		return drone_toc_view(self.server, drone_id, 'param')
 
 
 	@multi_drones
@@ -85,7 +177,7 @@ class ParamModule(OscModule):
 		drone_id = int(path_args['drone_id'])
 		toc_variable = str(path_args['toc_variable'])
 
-		toc = self._get_toc(drone_id)
+		toc = self._get_toc(drone_id).groups
 		if toc_variable in toc:
 			self._send('/'+str(drone_id)+'/toc/'+toc_variable, toc[toc_variable])
 
@@ -103,13 +195,8 @@ class ParamModule(OscModule):
 
 		"""
 
-		print(address)
-
 		drone_id = int(path_args['drone_id'])
-
-		toc = self._get_toc(drone_id)
-
-		self._send('/'+str(drone_id)+'/toc', json.dumps(toc))
+		self._send_chunked('/'+str(drone_id)+'/toc', self._get_toc(drone_id).json)
 
 
 	@multi_drones
@@ -125,21 +212,93 @@ class ParamModule(OscModule):
 		"""
 		drone_id = int(path_args['drone_id'])
 
-		self.server.drones[drone_id]['cf'].param.request_update_of_all_params()
+		drone = self.server.drones[drone_id]
+		# bulk : after everything else, and only once if asked again meanwhile
+		drone['radio'].push(PRIORITY_TOC, drone['cf'].param.request_update_of_all_params,
+			key='all_params')
+
+
+	@multi_drones
+	@drone_connected
+	def osc_snapshot(self, address, timeout=SNAPSHOT_TIMEOUT, **path_args):
+		"""Reads all param values of drones {drones}, and sends them at once as JSON
+		instead of one message per param.
+
+		OSC listen: /{drones}/snapshot
+
+		OSC publish: /{drone_id}/snapshot then /{drone_id}/snapshot/done
+
+		:param {drones}: drones ids separated by a ';'. * for all.
+		:type {drones}: str.
+
+		:param timeout: optional. Seconds after which the snapshot is sent even if some values are missing
+			(default 5).
+		:type timeout: float.
+
+		"""
+		drone_id = int(path_args['drone_id'])
+
+		drone = self.server.drones[drone_id]
+		snapshot = ParamSnapshot(drone['cf'].param.toc.toc)
+		# before the snapshot is visible : whoever finishes or drops it can cancel the job
+		snapshot.job = self.server.scheduler.once(float(timeout),
+			partial(self._finish_snapshot, drone_id, snapshot), priority=PRIORITY_LOW, name='param_snapshot')
+		with self._snapshots_lock:
+			if drone_id in self.snapshots:
+				self._debug('snapshot of drone', drone_id, 'already in progress')
+				snapshot.job.cancel()
+				return
+			self.snapshots[drone_id] = snapshot
+
+		self._debug('taking a snapshot of the', snapshot.size, 'params of drone', drone_id)
+		drone['radio'].push(PRIORITY_TOC, drone['cf'].param.request_update_of_all_params,
+			key='all_params')
+
+
+	def _finish_snapshot(self, drone_id, snapshot):
+		with self._snapshots_lock:
+			if self.snapshots.get(drone_id) is not snapshot:
+				return
+			del self.snapshots[drone_id]
+		snapshot.job.cancel()
+
+		values = snapshot.values()
+		received = sum(len(names) for names in values.values())
+		if received < snapshot.size:
+			self._error('snapshot of drone', drone_id, 'missing', snapshot.size - received, 'params')
+		self._send_chunked('/'+str(drone_id)+'/snapshot', json.dumps(values))
+		self._send('/'+str(drone_id)+'/snapshot/done',
+			[received, snapshot.size, float(time.monotonic() - snapshot.started_at)])
 
 
 	def add_param_cb(self, drone_id):
 		if drone_id in self.server.drones and self.server.drones[drone_id]['connected']:
+			# values of a previous connection may be outdated
+			self.shadows[drone_id] = ParamShadow(self.server.drones[drone_id]['cf'].param.toc)
+			with self._snapshots_lock:
+				snapshot = self.snapshots.pop(drone_id, None)
+			if snapshot is not None:
+				snapshot.job.cancel()
 			for group in self.server.drones[drone_id]['cf'].param.toc.toc:
 				self.server.drones[drone_id]['cf']\
 				.param.add_update_callback(group=group, name=None,
-					cb=self._on_param_update(drone_id))
+					cb=self.server.engine.marshal(self._on_param_update(drone_id)))
 
 
 	def _on_param_update(self, drone_id):
-		drone_id = str(drone_id)
+		shadow = self.shadows[drone_id]
+		snapshots = self.snapshots
 		def callback(param, value):
+			# write confirmations and reads asked by /get are always sent on their own
+			awaited = shadow.update(param, value)
+			# the other values awaited by a snapshot are sent with it
+			snapshot = snapshots.get(drone_id)
+			if snapshot is not None and snapshot.add(param, value):
+				if snapshot.complete:
+					self._finish_snapshot(drone_id, snapshot)
+				if not awaited:
+					return
 			param_group, param_name = param.split('.')
-			self._send('/'.join([drone_id, param_group, param_name]),
+			self._send('/'.join([str(drone_id), param_group, param_name]),
 				value)
 		return callback
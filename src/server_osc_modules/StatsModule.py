@@ -0,0 +1,55 @@
+from .OscModule import OscModule
+import json
+
+class StatsModule(OscModule):
+
+	"""
+	StatsModule class. Publishes the performance counters of the server components.
+	Components register a function returning their counters in server.stats.
+
+	OSC publish :
+
+	/{name} -> json (chunked when large, see ClientModule)
+
+	"""
+
+	@staticmethod
+	def get_name():
+		return 'STATS'
+
+	def __init__(self, server, base_topic, debug=False):
+		super(StatsModule, self).__init__(server=server, base_topic=base_topic, debug=debug)
+
+	def routes(self):
+		self.add_route('/send', self.osc_send_stats)
+		self.add_route('/{name}/send', self.osc_send_stat)
+
+
+	def osc_send_stats(self, address, *args):
+		"""
+		Sends the counters of every registered component.
+
+		OSC listen: /send
+
+		"""
+
+		for name in list(self.server.stats.keys()):
+			self.osc_send_stat(address, name=name)
+
+
+	def osc_send_stat(self, address, *args, **path_args):
+		"""
+		Sends the counters of the component {name} as JSON on /{name}.
+
+		OSC listen: /{name}/send
+
+		:param {name}: the component name (ex: ingest, clients).
+		:type {name}: str.
+
+		"""
+
+		name = str(path_args['name'])
+		if name not in self.server.stats:
+			self._error('no stats named', name)
+			return
+		self._send_chunked('/' + name, json.dumps(self.server.stats[name]()))
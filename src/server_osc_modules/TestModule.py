@@ -1,6 +1,5 @@
 from .OscModule import OscModule
 from .osc_validators import *
-from .CrazyflieModule import set_interval
 
 class TestModule(OscModule):
 	@staticmethod
@@ -16,7 +15,7 @@ class TestModule(OscModule):
 			self.tick += 1
 			self._debug(self.tick)
 			self._send('/tick', self.tick)
-		self.stop_tick_timer = set_interval(send_tick, 0.1)
+		self.tick_job = self.server.scheduler.every(0.1, send_tick, name='test_tick')
 
 	def routes(self):
 		self.add_route('/vector', self.test_vector)
@@ -44,4 +43,4 @@ class TestModule(OscModule):
 		self._debug('special', path_args)
 
 	def stop(self):
-		self.stop_tick_timer()
+		self.tick_job.cancel()
@@ -4,6 +4,18 @@ from .CrazyflieModule import CrazyflieModule
 from .ClientModule import ClientModule
 from .LogModule import LogModule
 from .ParamModule import ParamModule
+from .StatsModule import StatsModule
+from .osc_router import OscRouter
+from .osc_ingest import OscIngestServer
+from .osc_engine import ThreadEngine, AsyncioEngine
+from .osc_scheduler import Scheduler
+from .radio_queue import RadioCommandQueue
+from .connection_batch import ConnectionBatch
+from .toc_cache import SharedTocCache
+from .chunked_transfer import ChunkedTransfers
+from .param_shadow import ParamShadow, ParamSnapshot
+from .swarm_state import SwarmState
+from .trajectory import Trajectory
 
 # meta server
 
@@ -0,0 +1,103 @@
+import threading
+import zlib
+
+from collections import OrderedDict
+
+# characters of payload per chunk : a chunk message stays well under the MTU
+CHUNK_SIZE = 1024
+# transfers kept for resend requests
+MAX_TRANSFERS = 64
+
+
+class ChunkedTransfers(object):
+	"""
+	Splits large string payloads (JSON TOCs, snapshots, stats) into sequenced chunks,
+	so that no OSC message gets IP fragmented.
+
+	A payload sent on {address} becomes :
+
+	{address}/manifest -> transfer_id, chunk_count, length, crc32 (8 hex digits, of the UTF-8 payload)
+
+	{address}/chunk -> transfer_id, index, text
+
+	and the last transfers are kept, so that clients can ask again for missing chunks.
+	Payloads fitting in one chunk are sent as is, on {address}.
+	"""
+
+	def __init__(self, chunk_size=CHUNK_SIZE, max_transfers=MAX_TRANSFERS):
+		self.chunk_size = chunk_size
+		self.max_transfers = max_transfers
+
+		self._lock = threading.Lock()
+		self._transfers = OrderedDict() # transfer_id -> (address, manifest, chunks)
+		self._next_id = 1
+
+		self.transfers = 0
+		self.chunks = 0
+		self.resent = 0
+		self.expired = 0
+
+
+	def split(self, address, payload):
+		"""
+		Returns the (address, data) messages carrying payload.
+
+		:param address: the OSC address the payload is for.
+		:type address: str.
+		:param payload: the payload.
+		:type payload: str.
+		"""
+		if len(payload) <= self.chunk_size:
+			return [(address, payload)]
+
+		chunks = [payload[i:i + self.chunk_size] for i in range(0, len(payload), self.chunk_size)]
+		crc = '{:08x}'.format(zlib.crc32(payload.encode('utf-8')) & 0xffffffff)
+		with self._lock:
+			transfer_id = self._next_id
+			self._next_id += 1
+			manifest = [transfer_id, len(chunks), len(payload), crc]
+			self._transfers[transfer_id] = (address, manifest, chunks)
+			while len(self._transfers) > self.max_transfers:
+				self._transfers.popitem(last=False)
+			self.transfers += 1
+			self.chunks += len(chunks)
+		return self._messages(transfer_id, address, manifest, chunks, range(len(chunks)))
+
+
+	def resend(self, transfer_id, indexes=None):
+		"""
+		Returns the messages of the chunks indexes of a transfer (with its manifest when indexes is empty),
+		or None if the transfer is not kept anymore.
+		"""
+		with self._lock:
+			transfer = self._transfers.get(transfer_id)
+			if transfer is None:
+				self.expired += 1
+				return None
+			address, manifest, chunks = transfer
+			if indexes:
+				indexes = [i for i in indexes if 0 <= i < len(chunks)]
+				messages = self._messages(transfer_id, address, None, chunks, indexes)
+			else:
+				messages = self._messages(transfer_id, address, manifest, chunks, range(len(chunks)))
+			self.resent += len(messages)
+		return messages
+
+
+	@staticmethod
+	def _messages(transfer_id, address, manifest, chunks, indexes):
+		messages = [(address + '/manifest', manifest)] if manifest is not None else []
+		messages.extend((address + '/chunk', [transfer_id, i, chunks[i]]) for i in indexes)
+		return messages
+
+
+	def stats(self):
+		with self._lock:
+			return {
+				'chunk_size': self.chunk_size,
+				'kept': len(self._transfers),
+				'transfers': self.transfers,
+				'chunks': self.chunks,
+				'resent': self.resent,
+				'expired': self.expired,
+			}
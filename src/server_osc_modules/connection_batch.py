@@ -0,0 +1,82 @@
+import threading
+
+from collections import OrderedDict, deque
+
+
+def radio_of(uri):
+	"""
+	Returns the radio (ex: radio://0) a link URI (ex: radio://0/80/2M/E7E7E7E701) goes through.
+	"""
+	return '/'.join(uri.split('/')[:3])
+
+
+class ConnectionBatch(object):
+	"""
+	Connects a list of drones, at most per_radio at a time through each radio.
+
+	connect(drone_id, uri) opens a link and returns False if it could not be started.
+	The owner calls release(drone_id) when a link does not need the radio for its
+	connection anymore (connected or failed), which starts the next one on that radio,
+	and report(drone_id, result) when the drone is ready (or not) :
+	on_done(results) is called once every drone reported.
+	"""
+
+	def __init__(self, drones, per_radio, connect, on_done):
+		self.per_radio = max(1, int(per_radio))
+		self.connect = connect
+		self.on_done = on_done
+
+		self._lock = threading.Lock()
+		self._pending = OrderedDict() # radio -> deque of (drone_id, uri)
+		self._active = {} # radio -> connecting drone ids
+		self._radios = {} # drone_id -> radio
+		self.results = {}
+		for drone_id, uri in drones:
+			radio = radio_of(uri)
+			self._pending.setdefault(radio, deque()).append((drone_id, uri))
+			self._active.setdefault(radio, set())
+			self._radios[drone_id] = radio
+
+
+	def start(self):
+		with self._lock:
+			to_start = [drone for radio in self._pending for drone in self._next(radio)]
+		self._connect(to_start)
+
+
+	def _next(self, radio):
+		to_start = []
+		pending = self._pending[radio]
+		while pending and len(self._active[radio]) < self.per_radio:
+			drone_id, uri = pending.popleft()
+			self._active[radio].add(drone_id)
+			to_start.append((drone_id, uri))
+		return to_start
+
+
+	def _connect(self, drones):
+		# outside of the lock : connection callbacks may come back before connect returns
+		for drone_id, uri in drones:
+			if not self.connect(drone_id, uri):
+				self.release(drone_id)
+				self.report(drone_id, {'error': 'not started'})
+
+
+	def release(self, drone_id):
+		with self._lock:
+			radio = self._radios.get(drone_id)
+			if radio is None or drone_id not in self._active[radio]:
+				return
+			self._active[radio].discard(drone_id)
+			to_start = self._next(radio)
+		self._connect(to_start)
+
+
+	def report(self, drone_id, result):
+		with self._lock:
+			if drone_id not in self._radios or drone_id in self.results:
+				return
+			self.results[drone_id] = result
+			done = len(self.results) == len(self._radios)
+		if done:
+			self.on_done(self.results)
@@ -0,0 +1,100 @@
+import struct
+
+from collections.abc import Iterable
+
+from pythonosc.osc_message_builder import OscMessageBuilder
+
+# same type inference as python-osc (bools are ints there too)
+_TYPE_TAGS = {
+	str: 's',
+	bytes: 'b',
+	int: 'i',
+	bool: 'i',
+	float: 'f',
+}
+
+_INT = struct.Struct('>i')
+
+
+def encode_message(address, data):
+	"""
+	Encodes an OSC message the same way SimpleUDPClient.send_message does.
+	"""
+	builder = OscMessageBuilder(address=address)
+	if not isinstance(data, Iterable) or isinstance(data, (str, bytes)):
+		data = [data]
+	for value in data:
+		builder.add_arg(value)
+	return builder.build().dgram
+
+
+def _pad(data):
+	"""
+	OSC strings are null terminated and padded to a multiple of 4 bytes.
+	"""
+	return data + b'\x00' * (4 - len(data) % 4)
+
+
+def _write_args(typetags, data):
+	dgram = b''
+	for tag, value in zip(typetags, data):
+		if tag == 's':
+			dgram += _pad(value.encode('utf-8'))
+		elif tag == 'b':
+			dgram += _INT.pack(len(value)) + value + b'\x00' * (-len(value) % 4)
+		elif tag == 'i':
+			dgram += _INT.pack(value)
+		else:
+			dgram += struct.pack('>f', value)
+	return dgram
+
+
+class OscEncoder(object):
+	"""
+	Encodes outbound OSC messages.
+
+	The encoded address and type tags of each (address, signature) are cached,
+	so sending on a known topic only packs the arguments,
+	with a precompiled struct for numeric-only signatures.
+	"""
+
+	def __init__(self, cache_size=8192):
+		self._templates = {}
+		self._cache_size = cache_size
+
+
+	def _template(self, address, typetags):
+		key = (address, typetags)
+		template = self._templates.get(key)
+		if template is None:
+			prefix = _pad(address.encode('utf-8')) + _pad((',' + typetags).encode('utf-8'))
+			numeric = all(tag in 'if' for tag in typetags)
+			payload = struct.Struct('>' + typetags) if numeric else None
+			template = (prefix, payload)
+			if len(self._templates) >= self._cache_size:
+				self._templates.clear()
+			self._templates[key] = template
+		return template
+
+
+	def encode(self, address, data):
+		"""
+		Returns the OSC datagram of address with data as arguments.
+
+		:param data: a single value or a list/tuple of values.
+		"""
+		if not isinstance(data, (list, tuple)):
+			data = (data,)
+		try:
+			typetags = ''.join([_TYPE_TAGS[type(value)] for value in data])
+		except KeyError:
+			# unusual types : let python-osc deal with them
+			return encode_message(address, data)
+
+		prefix, payload = self._template(address, typetags)
+		try:
+			if payload is not None:
+				return prefix + payload.pack(*data)
+			return prefix + _write_args(typetags, data)
+		except struct.error:
+			return encode_message(address, data)
@@ -0,0 +1,158 @@
+import asyncio
+import threading
+import time
+
+from functools import wraps
+
+from .osc_ingest import OscIngestServer, dispatch_received
+from .osc_scheduler import Scheduler
+
+
+class ThreadEngine(object):
+	"""
+	Default engine : OSC packets are handled by an OscIngestServer worker pool,
+	periodic jobs run on the scheduler thread and cflib callbacks run on cflib threads.
+	"""
+
+	name = 'threads'
+
+	def __init__(self, workers=4, queue_size=1024):
+		self.workers = workers
+		self.queue_size = queue_size
+		self._osc_server = None
+		self._osc_server_thread = None
+		self._running = False
+		self.scheduler = Scheduler()
+
+
+	def marshal(self, callback):
+		"""
+		Returns callback, wrapped to be run by the engine when called from another thread.
+		"""
+		return callback
+
+
+	def serve(self, address, dispatcher):
+		self._osc_server = OscIngestServer(address, dispatcher,
+			workers=self.workers, queue_size=self.queue_size)
+		self._osc_server_thread = threading.Thread(target=self._osc_server.serve_forever)
+		self._osc_server_thread.start()
+		return self._osc_server.server_address
+
+
+	def stats(self):
+		return self._osc_server.stats() if self._osc_server else {}
+
+
+	def run(self):
+		"""
+		Blocks until stop() is called.
+		"""
+		self._running = True
+		self.scheduler.start()
+		while self._running: # windows is trash
+			time.sleep(1)
+
+
+	def stop(self):
+		self._running = False
+		self.scheduler.stop()
+		if self._osc_server:
+			self._osc_server.shutdown()
+			self._osc_server = None
+			self._osc_server_thread = None
+
+
+class _OscProtocol(asyncio.DatagramProtocol):
+	def __init__(self, engine, dispatcher):
+		self.engine = engine
+		self.dispatcher = dispatcher
+
+
+	def datagram_received(self, data, addr):
+		self.engine.received += 1
+		try:
+			dispatch_received(self.dispatcher, data, time.monotonic())
+		except Exception as e:
+			self.engine.errors += 1
+			self.engine.loop.call_exception_handler({'message': 'OSC handler failed', 'exception': e})
+
+
+class AsyncioEngine(object):
+	"""
+	Single event loop engine : OSC receive, dispatch, client broadcasts and scheduler jobs
+	all run on one asyncio loop, and cflib callbacks are marshalled into it.
+
+	Handlers must not block : they delay everything else.
+	"""
+
+	name = 'asyncio'
+
+	def __init__(self):
+		self.loop = asyncio.new_event_loop()
+		self._transport = None
+		self._loop_thread = None
+		self.received = 0
+		self.errors = 0
+
+		self.scheduler = Scheduler()
+		self.scheduler.wakeup = lambda: self.loop.call_soon_threadsafe(self._run_scheduler)
+		self._scheduler_handle = None
+
+
+	def _call(self, func, *args):
+		if threading.current_thread() is self._loop_thread:
+			func(*args)
+		else:
+			self.loop.call_soon_threadsafe(func, *args)
+
+
+	def _run_scheduler(self):
+		if self._scheduler_handle is not None:
+			self._scheduler_handle.cancel()
+		delay = self.scheduler.run_pending()
+		if delay is not None:
+			self._scheduler_handle = self.loop.call_later(delay, self._run_scheduler)
+		else:
+			self._scheduler_handle = None
+
+
+	def marshal(self, callback):
+		@wraps(callback)
+		def wrapped(*args):
+			self._call(callback, *args)
+		return wrapped
+
+
+	def serve(self, address, dispatcher):
+		listen = self.loop.create_datagram_endpoint(
+			lambda: _OscProtocol(self, dispatcher), local_addr=address)
+		self._transport, _ = self.loop.run_until_complete(listen)
+		return self._transport.get_extra_info('sockname')
+
+
+	def stats(self):
+		return {
+			'received': self.received,
+			'errors': self.errors,
+		}
+
+
+	def run(self):
+		"""
+		Runs the loop until stop() is called.
+		"""
+		self._loop_thread = threading.current_thread()
+		asyncio.set_event_loop(self.loop)
+		self.loop.call_soon(self._run_scheduler)
+		self.loop.run_forever()
+		self.scheduler.stop()
+		if self._transport is not None:
+			self._transport.close()
+		self.loop.run_until_complete(asyncio.sleep(0))
+		self.loop.close()
+
+
+	def stop(self):
+		self.loop.call_soon_threadsafe(self.loop.stop)
+
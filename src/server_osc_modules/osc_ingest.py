@@ -0,0 +1,154 @@
+import socketserver
+import threading
+import time
+
+from collections import deque
+
+_receive_context = threading.local()
+
+
+def receive_time():
+	"""
+	Returns the time.monotonic() at which the datagram being dispatched by this thread
+	was received, or None when not called from an OSC handler.
+	"""
+	return getattr(_receive_context, 'time', None)
+
+
+def dispatch_received(dispatcher, dgram, received_at):
+	"""
+	Dispatches dgram, with receive_time() returning received_at in its handlers.
+	"""
+	_receive_context.time = received_at
+	try:
+		dispatcher.dispatch_datagram(dgram)
+	finally:
+		_receive_context.time = None
+
+
+class OscIngestServer(socketserver.UDPServer):
+	"""
+	OSC UDP server dispatching datagrams to an OscRouter on a fixed pool of worker threads.
+
+	Datagrams wait in a bounded queue : when it is full, new datagrams are dropped.
+	Messages of routes added with coalesce=True (goals, setpoints...) are latest-wins :
+	while a message is waiting for a worker, a newer one on the same address replaces it.
+	The newer one takes the place of the older one only if nothing was queued after it,
+	otherwise the older one is dropped and the newer one queued last, to keep the order of the messages.
+	Messages of routes added with urgent=True (emergency stops) never wait in the queue nor are dropped :
+	they are dispatched on the receiving thread, ahead of everything queued.
+	"""
+
+	def __init__(self, server_address, dispatcher, workers=4, queue_size=1024):
+		super(OscIngestServer, self).__init__(server_address, None)
+		self.dispatcher = dispatcher
+		self.queue_size = queue_size
+
+		self._queue = deque()
+		self._latest = {}  # coalescing key -> waiting [key, dgram, received_at] cell
+		self._condition = threading.Condition()
+		self._running = True
+
+		self.received = 0
+		self.processed = 0
+		self.dropped = 0
+		self.coalesced = 0
+		self.urgent = 0
+		self.max_depth = 0
+
+		self._workers = [threading.Thread(target=self._work, name='osc-worker-'+str(i))
+			for i in range(workers)]
+		for worker in self._workers:
+			worker.start()
+
+
+	def verify_request(self, request, client_address):
+		data = request[0]
+		return data[:1] == b'/' or data[:8] == b'#bundle\x00'
+
+
+	def process_request(self, request, client_address):
+		"""
+		Called on the receiving thread : only queues the datagram (or dispatches it, if urgent).
+		"""
+		dgram = request[0]
+		received_at = time.monotonic()
+		if self.dispatcher.is_urgent(dgram):
+			self._dispatch_urgent(dgram, received_at)
+			return
+		key = self.dispatcher.coalescing_key(dgram)
+		with self._condition:
+			self.received += 1
+			waiting = self._latest.get(key) if key is not None else None
+			if waiting is not None:
+				self.coalesced += 1
+				if self._queue[-1] is waiting:
+					waiting[1] = dgram
+					waiting[2] = received_at
+					return
+				# something was queued after it : the older message is dropped where it is
+				waiting[1] = None
+			elif len(self._queue) >= self.queue_size:
+				self.dropped += 1
+				return
+			cell = [key, dgram, received_at]
+			if key is not None:
+				self._latest[key] = cell
+			self._queue.append(cell)
+			self.max_depth = max(self.max_depth, len(self._queue))
+			self._condition.notify()
+
+
+	def _dispatch_urgent(self, dgram, received_at):
+		with self._condition:
+			self.received += 1
+			self.urgent += 1
+		try:
+			dispatch_received(self.dispatcher, dgram, received_at)
+		except Exception:
+			self.handle_error(dgram, None)
+		with self._condition:
+			self.processed += 1
+
+
+	def _work(self):
+		while True:
+			with self._condition:
+				while self._running and not self._queue:
+					self._condition.wait()
+				if not self._running:
+					return
+				key, dgram, received_at = self._queue.popleft()
+				if dgram is None:
+					continue
+				if key is not None:
+					del self._latest[key]
+			try:
+				dispatch_received(self.dispatcher, dgram, received_at)
+			except Exception:
+				self.handle_error(dgram, None)
+			with self._condition:
+				self.processed += 1
+
+
+	def stats(self):
+		with self._condition:
+			return {
+				'received': self.received,
+				'processed': self.processed,
+				'dropped': self.dropped,
+				'coalesced': self.coalesced,
+				'urgent': self.urgent,
+				'queue_depth': len(self._queue),
+				'max_queue_depth': self.max_depth,
+			}
+
+
+	def shutdown(self):
+		super(OscIngestServer, self).shutdown()
+		with self._condition:
+			self._running = False
+			self._condition.notify_all()
+		for worker in self._workers:
+			worker.join()
+		self.server_close()
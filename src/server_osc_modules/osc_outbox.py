@@ -0,0 +1,88 @@
+import struct
+import threading
+
+# '#bundle' + the "immediately" timetag
+BUNDLE_HEADER = b'#bundle\x00' + struct.pack('>Q', 1)
+_ELEMENT_SIZE = struct.Struct('>i')
+
+
+class OscOutbox(object):
+	"""
+	Collects encoded OSC messages per destination, and sends them
+	as OSC bundles no bigger than the MTU when flushed.
+	"""
+
+	def __init__(self, send_many, mtu=1400):
+		"""
+		:param send_many: function called with the list of (destination, packet) tuples to send.
+		:type send_many: function.
+		:param mtu: maximum size (in bytes) of a bundle.
+		:type mtu: int.
+		"""
+		self._send_many = send_many
+		self.mtu = mtu
+		self._pending = {}
+		self._lock = threading.Lock()
+
+
+	def push(self, destination, dgram):
+		"""
+		Queues an encoded message for destination until the next flush.
+		"""
+		with self._lock:
+			if destination not in self._pending:
+				self._pending[destination] = []
+			self._pending[destination].append(dgram)
+
+
+	def discard(self, destination):
+		"""
+		Drops the queued messages of destination.
+		"""
+		with self._lock:
+			self._pending.pop(destination, None)
+
+
+	def flush(self):
+		"""
+		Sends everything queued since the last flush.
+		"""
+		with self._lock:
+			pending, self._pending = self._pending, {}
+
+		packets = []
+		for destination, dgrams in pending.items():
+			for packet in self._packets(dgrams):
+				packets.append((destination, packet))
+		if packets:
+			self._send_many(packets)
+
+
+	def _packets(self, dgrams):
+		"""
+		Groups dgrams into bundles of at most self.mtu bytes.
+		A lonely message is sent as is, without the bundle overhead.
+		"""
+		bundle = []
+		size = len(BUNDLE_HEADER)
+		for dgram in dgrams:
+			element_size = _ELEMENT_SIZE.size + len(dgram)
+			if bundle and size + element_size > self.mtu:
+				yield self._build(bundle)
+				bundle = []
+				size = len(BUNDLE_HEADER)
+			bundle.append(dgram)
+			size += element_size
+		if bundle:
+			yield self._build(bundle)
+
+
+	@staticmethod
+	def _build(dgrams):
+		if len(dgrams) == 1:
+			return dgrams[0]
+		parts = [BUNDLE_HEADER]
+		for dgram in dgrams:
+			parts.append(_ELEMENT_SIZE.pack(len(dgram)))
+			parts.append(dgram)
+		return b''.join(parts)
@@ -0,0 +1,431 @@
+import re
+import struct
+import threading
+import time
+
+from functools import partial
+
+from pythonosc import osc_message
+from pythonosc.dispatcher import Handler
+
+from .osc_scheduler import PRIORITY_HIGH
+
+
+# {name} or {name:type} in a route segment
+_CAPTURE = re.compile('^\{(\w+)(?::(\w+))?\}$')
+
+CONVERTERS = {
+	'str': str,
+	'int': int,
+	'float': float,
+}
+
+# OSC type tag -> struct format, for the fast path
+_FAST_TYPES = {
+	'i': 'i',
+	'f': 'f',
+	'd': 'd',
+	'h': 'q',
+}
+
+
+# bundles are parsed here : python-osc reads timetags as signed ints, so they all look past
+_BUNDLE_TAG = b'#bundle\x00'
+_TIMETAG = struct.Struct('>II')
+_ELEMENT_SIZE = struct.Struct('>i')
+_IMMEDIATELY = (0, 1)
+_NTP_DELTA = 2208988800 # seconds from 1900 to 1970
+# bundles jobs are scheduled this early, then wait for their exact time (thread wake ups are late)
+_BUNDLE_LEAD = 0.002
+
+
+def _bundle_messages(dgram, start, end, timetag, messages):
+	"""
+	Appends the (timetag, message datagram) of the bundle in dgram[start:end]
+	(and of its nested bundles) to messages. timetag is a unix time, or None for immediately.
+	"""
+	if end - start < 16:
+		raise osc_message.ParseError('bundle too short')
+	seconds, fraction = _TIMETAG.unpack_from(dgram, start + 8)
+	if (seconds, fraction) != _IMMEDIATELY:
+		timetag = seconds - _NTP_DELTA + fraction / 2**32
+	index = start + 16
+	while index < end:
+		if index + 4 > end:
+			raise osc_message.ParseError('truncated bundle element')
+		size, = _ELEMENT_SIZE.unpack_from(dgram, index)
+		index += 4
+		if size <= 0 or index + size > end:
+			raise osc_message.ParseError('bad bundle element size')
+		if dgram[index:index + 8] == _BUNDLE_TAG:
+			_bundle_messages(dgram, index, index + size, timetag, messages)
+		else:
+			messages.append((timetag, dgram[index:index + size]))
+		index += size
+
+
+def _padded(offset):
+	return (offset + 4) & ~3
+
+
+def _compile_signature(typetags):
+	"""
+	Compiles an OSC type tag string into a decoder(data, offset) -> args.
+	Fixed size arguments are read with precompiled structs, blobs as memoryview slices.
+	"""
+	steps = []
+	fmt = ''
+	for tag in typetags:
+		if tag in _FAST_TYPES:
+			fmt += _FAST_TYPES[tag]
+		elif tag == 'b':
+			if fmt:
+				steps.append(struct.Struct('>' + fmt))
+				fmt = ''
+			steps.append(None)
+		else:
+			raise ValueError('type tag not supported by the fast path: ' + tag)
+	if fmt:
+		steps.append(struct.Struct('>' + fmt))
+
+	if len(steps) == 1 and steps[0] is not None:
+		return steps[0].unpack_from
+
+	blob_size = struct.Struct('>i')
+	def decode(data, offset):
+		args = ()
+		for step in steps:
+			if step is None:
+				size, = blob_size.unpack_from(data, offset)
+				offset += 4
+				if offset + size > len(data):
+					raise struct.error('blob too long')
+				args += (data[offset:offset + size],)
+				offset += (size + 3) & ~3
+			else:
+				args += step.unpack_from(data, offset)
+				offset += step.size
+		return args
+	return decode
+
+
+class Route(object):
+	"""
+	A compiled route : its pattern and the handler bound to it.
+	Routes with a signature are decoded directly from the datagram when it matches.
+	Routes with coalesce set only care about their latest message,
+	urgent routes are dispatched ahead of any queued message (see OscIngestServer).
+	"""
+	def __init__(self, pattern, callback, signature=None, coalesce=False, urgent=False):
+		self.pattern = pattern
+		self.callback = callback
+		self.coalesce = coalesce
+		self.urgent = urgent
+		self.signature = signature.encode('ascii') if signature else None
+		self.decode = _compile_signature(signature) if signature else None
+
+
+class _RouteNode(object):
+	"""
+	A node of the route trie. One node per path segment.
+	"""
+	def __init__(self):
+		self.literals = {}
+		self.captures = []  # [(name, converter, node)]
+		self.route = None
+
+
+	def child(self, segment):
+		m = _CAPTURE.match(segment)
+		if m is None:
+			if segment not in self.literals:
+				self.literals[segment] = _RouteNode()
+			return self.literals[segment]
+
+		name, type_name = m.group(1), m.group(2) or 'str'
+		if type_name not in CONVERTERS:
+			raise ValueError('unknown capture type: ' + type_name)
+		converter = CONVERTERS[type_name]
+		for (n, c, node) in self.captures:
+			if n == name and c is converter:
+				return node
+		node = _RouteNode()
+		self.captures.append((name, converter, node))
+		return node
+
+
+	def match(self, segments, index, path_args):
+		if index == len(segments):
+			return self.route
+
+		segment = segments[index]
+		# literal segments always win over captures
+		if segment in self.literals:
+			route = self.literals[segment].match(segments, index + 1, path_args)
+			if route is not None:
+				return route
+
+		for (name, converter, node) in self.captures:
+			try:
+				value = converter(segment)
+			except ValueError:
+				continue
+			path_args[name] = value
+			route = node.match(segments, index + 1, path_args)
+			if route is not None:
+				return route
+			del path_args[name]
+		return None
+
+
+class OscRouter(object):
+	"""
+	Routes OSC addresses to exactly one handler.
+
+	Routes are compiled once into a segment trie when they are added,
+	so resolving an address costs O(path depth), and resolved addresses are cached.
+	It can be used instead of the python-osc Dispatcher.
+
+	Route syntax : /literal/{capture}/{typed_capture:int}
+
+	dispatch_datagram() has a fast path for routes registered with a signature (ex: 'ffff') :
+	when a message has this exact signature, its arguments are unpacked directly from the datagram.
+	Anything else goes through the python-osc parser.
+
+	Bundles timetagged in the future are queued in the scheduler (when given),
+	then all their messages are dispatched together at their time.
+	"""
+
+	def __init__(self, cache_size=4096, scheduler=None, max_pending_bundles=1024):
+		self._root = _RouteNode()
+		self._cache = {}
+		self._cache_size = cache_size
+		self._default_handler = None
+
+		self.scheduler = scheduler
+		self.max_pending_bundles = max_pending_bundles
+		self._bundles_lock = threading.Lock()
+		self._pending_bundles = 0
+		self._bundles_scheduled = 0
+		self._bundles_dropped = 0
+		self._bundles_dispatched = 0
+		self._total_jitter = 0.0
+		self._max_jitter = 0.0
+
+
+	def add_route(self, pattern, callback, signature=None, coalesce=False, urgent=False):
+		"""
+		Compiles a new route.
+
+		:param pattern: the route pattern (ex: /crazyflie/{drone_id:int}/goal).
+		:type pattern: str.
+		:param callback: the route handler, called with (address, *osc_args, **path_args).
+		:type callback: function.
+		:param signature: optional. The OSC type tags (i, f, d, h, b) of the hot messages of this route.
+		:type signature: str.
+		:param coalesce: optional. True if only the latest message of each address matters (ex: goals).
+		:type coalesce: bool.
+		:param urgent: optional. True if the messages must never wait nor be dropped (ex: emergency).
+		:type urgent: bool.
+		"""
+		node = self._root
+		for segment in pattern.strip('/').split('/'):
+			node = node.child(segment)
+		if node.route is not None:
+			raise ValueError('route already defined: ' + pattern)
+		node.route = Route(pattern, callback, signature, coalesce, urgent)
+		self._cache.clear()
+		return node.route
+
+
+	def resolve(self, address):
+		"""
+		Returns the (route, path_args) tuple matching address, or None.
+		"""
+		try:
+			return self._cache[address]
+		except KeyError:
+			pass
+
+		path_args = {}
+		route = self._root.match(address.strip('/').split('/'), 0, path_args)
+		resolved = (route, path_args) if route is not None else None
+
+		if len(self._cache) >= self._cache_size:
+			self._cache.clear()
+		self._cache[address] = resolved
+		return resolved
+
+
+	def handlers_for_address(self, address):
+		"""
+		python-osc Dispatcher compatible lookup.
+		"""
+		resolved = self.resolve(address)
+		if resolved is not None:
+			route, path_args = resolved
+			return [Handler(partial(route.callback, **path_args), [])]
+		if self._default_handler is not None:
+			return [Handler(self._default_handler, [])]
+		return []
+
+
+	def set_default_handler(self, handler):
+		self._default_handler = handler
+
+
+	@staticmethod
+	def _address_end(dgram):
+		if dgram[:1] != b'/':
+			return -1 # bundle
+		return dgram.find(b'\x00')
+
+
+	def _message_route(self, dgram):
+		"""
+		Returns the (address, route) of dgram if it is a message of a known route, None otherwise.
+		"""
+		end = self._address_end(dgram)
+		if end < 0:
+			return None
+		address = dgram[:end].decode('utf-8', 'replace')
+		resolved = self.resolve(address)
+		if resolved is None:
+			return None
+		return address, resolved[0]
+
+
+	def coalescing_key(self, dgram):
+		"""
+		Returns the address of dgram if it is a message of a coalescing route, None otherwise.
+		"""
+		message_route = self._message_route(dgram)
+		if message_route is None or not message_route[1].coalesce:
+			return None
+		return message_route[0]
+
+
+	def is_urgent(self, dgram):
+		"""
+		Returns True if dgram is a message of an urgent route.
+		"""
+		message_route = self._message_route(dgram)
+		return message_route is not None and message_route[1].urgent
+
+
+	def dispatch_datagram(self, dgram):
+		"""
+		Dispatches a raw OSC datagram (message or bundle).
+		"""
+		if self._dispatch_fast(dgram):
+			return
+		self._dispatch_packet(dgram)
+
+
+	def _dispatch_fast(self, dgram):
+		"""
+		Returns True if dgram was handled by the fast path.
+		"""
+		end = self._address_end(dgram)
+		if end < 0:
+			return False
+		address = dgram[:end].decode('utf-8', 'replace')
+		resolved = self.resolve(address)
+		if resolved is None or resolved[0].signature is None:
+			return False
+
+		route, path_args = resolved
+		tags_start = _padded(end)
+		tags_end = dgram.find(b'\x00', tags_start)
+		if tags_end < 0 or dgram[tags_start + 1:tags_end] != route.signature:
+			return False
+		try:
+			args = route.decode(memoryview(dgram), _padded(tags_end))
+		except struct.error:
+			return False
+		route.callback(address, *args, **path_args)
+		return True
+
+
+	def _dispatch_packet(self, dgram):
+		"""
+		Generic path : python-osc parsing of messages, timetags of bundles handled here.
+		"""
+		if dgram[:8] != _BUNDLE_TAG:
+			self._dispatch_message(dgram)
+			return
+
+		messages = []
+		try:
+			_bundle_messages(dgram, 0, len(dgram), None, messages)
+		except (osc_message.ParseError, struct.error):
+			return
+
+		now = time.time()
+		future = {} # timetag -> message datagrams
+		for timetag, message in messages:
+			if timetag is not None and timetag > now:
+				future.setdefault(timetag, []).append(message)
+			else:
+				self._dispatch_message(message)
+		for timetag, bundle in sorted(future.items()):
+			self._schedule_bundle(timetag, bundle)
+
+
+	def _dispatch_message(self, dgram):
+		if self._dispatch_fast(dgram):
+			return
+		try:
+			message = osc_message.OscMessage(dgram)
+		except osc_message.ParseError:
+			return
+		for handler in self.handlers_for_address(message.address):
+			handler.callback(message.address, *message)
+
+
+	def _dispatch_messages(self, messages):
+		for message in messages:
+			self._dispatch_message(message)
+
+
+	def _schedule_bundle(self, timetag, messages):
+		if self.scheduler is None:
+			time.sleep(max(0.0, timetag - time.time()))
+			self._dispatch_messages(messages)
+			return
+
+		with self._bundles_lock:
+			if self._pending_bundles >= self.max_pending_bundles:
+				self._bundles_dropped += 1
+				return
+			self._pending_bundles += 1
+			self._bundles_scheduled += 1
+		self.scheduler.once(max(0.0, timetag - time.time() - _BUNDLE_LEAD), partial(self._run_bundle, timetag, messages),
+			priority=PRIORITY_HIGH, name='bundles')
+
+
+	def _run_bundle(self, timetag, messages):
+		# the job runs a bit early : wait for the exact time
+		remaining = timetag - time.time()
+		if remaining > 0:
+			time.sleep(remaining)
+		jitter = abs(time.time() - timetag)
+		with self._bundles_lock:
+			self._pending_bundles -= 1
+			self._bundles_dispatched += 1
+			self._total_jitter += jitter
+			self._max_jitter = max(self._max_jitter, jitter)
+		self._dispatch_messages(messages)
+
+
+	def bundle_stats(self):
+		with self._bundles_lock:
+			return {
+				'pending': self._pending_bundles,
+				'scheduled': self._bundles_scheduled,
+				'dropped': self._bundles_dropped,
+				'dispatched': self._bundles_dispatched,
+				'mean_jitter_ms': 1000 * self._total_jitter / self._bundles_dispatched
+					if self._bundles_dispatched else 0,
+				'max_jitter_ms': 1000 * self._max_jitter,
+			}
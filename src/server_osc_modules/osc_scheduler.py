@@ -0,0 +1,199 @@
+import heapq
+import itertools
+import threading
+import time
+import traceback
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 10
+PRIORITY_LOW = 20
+
+
+class Job(object):
+	"""
+	A periodic (interval set) or one-shot job of a Scheduler.
+	"""
+
+	def __init__(self, scheduler, func, interval, next_time, priority, name):
+		self.scheduler = scheduler
+		self.func = func
+		self.interval = interval
+		self.next_time = next_time
+		self.priority = priority
+		self.name = name
+		self.cancelled = False
+
+		self.runs = 0
+		self.skipped = 0
+		self.total_lateness = 0.0
+		self.max_lateness = 0.0
+
+
+	def cancel(self):
+		self.scheduler.cancel(self)
+
+
+	def stats(self):
+		return {
+			'runs': self.runs,
+			'skipped': self.skipped,
+			'mean_jitter_ms': 1000 * self.total_lateness / self.runs if self.runs else 0,
+			'max_jitter_ms': 1000 * self.max_lateness,
+		}
+
+
+class Scheduler(object):
+	"""
+	Runs every periodic and one-shot job of the server from a single heap.
+
+	Jobs due on the same tick (within resolution seconds) run together, by priority.
+	Periodic jobs keep their phase : a late run does not delay the next ones,
+	and runs missed entirely are skipped.
+
+	The scheduler is either driven by its own thread (start()),
+	or by calling run_pending() when wakeup is called and when it says so.
+	"""
+
+	def __init__(self, resolution=0.001, clock=time.monotonic):
+		self.resolution = resolution
+		self.clock = clock
+		self.wakeup = None
+
+		self._heap = []
+		self._jobs = set()
+		self._counter = itertools.count()
+		self._condition = threading.Condition()
+		self._thread = None
+		self._running = False
+
+
+	def every(self, interval, func, phase=None, priority=PRIORITY_NORMAL, name=None):
+		"""
+		Calls func every interval seconds.
+
+		:param phase: delay before the first call. Defaults to interval.
+		:type phase: float.
+		:param priority: lower runs first when several jobs are due on the same tick.
+		:type priority: int.
+		:returns: the Job, which can be cancelled.
+		"""
+		delay = interval if phase is None else phase
+		return self._add(Job(self, func, interval, self.clock() + delay, priority, name))
+
+
+	def once(self, delay, func, priority=PRIORITY_NORMAL, name=None):
+		"""
+		Calls func once, in delay seconds.
+		"""
+		return self._add(Job(self, func, None, self.clock() + delay, priority, name))
+
+
+	def _add(self, job):
+		with self._condition:
+			self._jobs.add(job)
+			self._push(job)
+			earliest = self._heap[0][3] is job
+			self._condition.notify()
+		if earliest and self.wakeup is not None:
+			self.wakeup()
+		return job
+
+
+	def _push(self, job):
+		heapq.heappush(self._heap, (job.next_time, job.priority, next(self._counter), job))
+
+
+	def cancel(self, job):
+		with self._condition:
+			job.cancelled = True
+			self._jobs.discard(job)
+
+
+	def run_pending(self):
+		"""
+		Runs the due jobs. Returns the delay until the next job, or None if there is none.
+		"""
+		now = self.clock()
+		due = []
+		with self._condition:
+			while self._heap and self._heap[0][0] <= now + self.resolution:
+				_, _, _, job = heapq.heappop(self._heap)
+				if not job.cancelled:
+					due.append(job)
+
+		due.sort(key=lambda job: job.priority)
+		for job in due:
+			lateness = max(0.0, self.clock() - job.next_time)
+			job.runs += 1
+			job.total_lateness += lateness
+			job.max_lateness = max(job.max_lateness, lateness)
+			try:
+				job.func()
+			except Exception:
+				traceback.print_exc()
+
+			with self._condition:
+				if job.cancelled:
+					continue
+				if job.interval is None:
+					self._jobs.discard(job)
+					continue
+				job.next_time += job.interval
+				now = self.clock()
+				if job.next_time < now:
+					missed = int((now - job.next_time) / job.interval) + 1
+					job.skipped += missed
+					job.next_time += missed * job.interval
+				self._push(job)
+
+		with self._condition:
+			while self._heap and self._heap[0][3].cancelled:
+				heapq.heappop(self._heap)
+			if not self._heap:
+				return None
+			return max(0.0, self._heap[0][0] - self.clock())
+
+
+	def stats(self):
+		with self._condition:
+			jobs = list(self._jobs)
+		return {(job.name or repr(job.func)): job.stats() for job in jobs}
+
+
+	def start(self):
+		"""
+		Runs the jobs on a dedicated thread.
+		"""
+		self._running = True
+		self._thread = threading.Thread(target=self._run, name='scheduler')
+		self._thread.start()
+
+
+	def _run(self):
+		while True:
+			self.run_pending()
+			with self._condition:
+				if not self._running:
+					return
+				if not self._heap:
+					self._condition.wait()
+				else:
+					delay = self._heap[0][0] - self.clock()
+					if delay > 0:
+						self._condition.wait(delay)
+
+
+	def stop(self):
+		"""
+		Cancels every job and stops the scheduler thread.
+		"""
+		with self._condition:
+			self._running = False
+			for job in self._jobs:
+				job.cancelled = True
+			self._jobs.clear()
+			self._heap = []
+			self._condition.notify_all()
+		if self._thread is not None and self._thread is not threading.current_thread():
+			self._thread.join()
+		self._thread = None
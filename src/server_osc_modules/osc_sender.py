@@ -0,0 +1,77 @@
+import socket
+
+
+class ClientStats(object):
+	"""
+	Sending counters of one client.
+	"""
+	def __init__(self, ip, port, sockaddr):
+		self.ip = ip
+		self.port = port
+		self.sockaddr = sockaddr
+		self.sent = 0
+		self.dropped = 0 # socket buffer full
+		self.errors = 0 # any other socket error
+
+
+	def as_dict(self):
+		return {
+			'sent': self.sent,
+			'dropped': self.dropped,
+			'errors': self.errors,
+		}
+
+
+class OscSender(object):
+	"""
+	Sends already encoded OSC packets to every client through one shared non-blocking UDP socket.
+	Nothing is ever blocking : packets which cannot be sent are counted as dropped.
+	"""
+
+	def __init__(self):
+		self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		self._sock.setblocking(False)
+		self.clients = {}
+
+
+	def add_client(self, ip, port):
+		"""
+		Registers a client, resolving its address once.
+
+		:returns: the ClientStats of this client.
+		"""
+		sockaddr = (socket.gethostbyname(ip), port)
+		self.clients[(ip, port)] = ClientStats(ip, port, sockaddr)
+		return self.clients[(ip, port)]
+
+
+	def remove_client(self, ip, port):
+		self.clients.pop((ip, port), None)
+
+
+	def send_many(self, packets):
+		"""
+		Sends packets, a list of (client, packet) tuples, in a tight sendto loop.
+		"""
+		sendto = self._sock.sendto
+		clients = self.clients
+		for key, packet in packets:
+			client = clients.get(key)
+			if client is None:
+				continue
+			try:
+				sendto(packet, client.sockaddr)
+				client.sent += 1
+			except BlockingIOError:
+				client.dropped += 1
+			except OSError:
+				client.errors += 1
+
+
+	def stats(self):
+		return {'{}:{}'.format(ip, port): client.as_dict()
+			for (ip, port), client in list(self.clients.items())}
+
+
+	def close(self):
+		self._sock.close()
@@ -0,0 +1,214 @@
+import re
+import threading
+
+
+def _segment_regex(segment):
+	"""
+	Translates an OSC address pattern segment (*, ?, [...], {a,b}) to a regex.
+	Raises ValueError on an invalid segment (ex: unmatched [ or {).
+	"""
+	regex = ''
+	i = 0
+	while i < len(segment):
+		c = segment[i]
+		if c == '*':
+			regex += '[^/]*'
+		elif c == '?':
+			regex += '[^/]'
+		elif c == '[':
+			end = segment.find(']', i)
+			if end < 0:
+				raise ValueError('unmatched [ in ' + segment)
+			chars = segment[i + 1:end]
+			if chars.startswith('!'):
+				chars = '^' + chars[1:]
+			regex += '[' + chars + ']'
+			i = end
+		elif c == '{':
+			end = segment.find('}', i)
+			if end < 0:
+				raise ValueError('unmatched { in ' + segment)
+			choices = segment[i + 1:end].split(',')
+			regex += '(?:' + '|'.join(re.escape(choice) for choice in choices) + ')'
+			i = end
+		else:
+			regex += re.escape(c)
+		i += 1
+	try:
+		return re.compile('^' + regex + '$')
+	except re.error as e:
+		raise ValueError('invalid pattern segment ' + segment + ': ' + str(e))
+
+
+def _is_pattern(segment):
+	return any(c in segment for c in '*?[{')
+
+
+class _TopicNode(object):
+	def __init__(self):
+		self.literals = {}
+		self.patterns = {}  # segment -> (regex, node)
+		self.clients = {}  # client -> minimum period between two messages (0: no limit)
+
+
+	def empty(self):
+		return not (self.literals or self.patterns or self.clients)
+
+
+class SubscriptionTrie(object):
+	"""
+	Stores the OSC address patterns subscribed by each client in a prefix trie.
+
+	A pattern matches an address if it matches the first segments of this address :
+	subscribing to /log/1 receives /log/1/position, /log/1/battery/pm.vbat, ...
+	"""
+
+	def __init__(self):
+		self._root = _TopicNode()
+		self._lock = threading.Lock()
+
+
+	@staticmethod
+	def _segments(pattern):
+		pattern = pattern.strip('/')
+		return pattern.split('/') if pattern else []
+
+
+	def subscribe(self, client, pattern, period=0):
+		"""
+		Subscribes client to pattern.
+
+		:param period: the minimum time (in seconds) between two messages of a same address. 0 for no limit.
+		:type period: float.
+		:raises ValueError: if pattern is not a valid OSC address pattern (the trie is left unchanged).
+		"""
+		# compiled before touching the trie, so that an invalid pattern leaves no empty node
+		regexes = {segment: _segment_regex(segment)
+			for segment in self._segments(pattern) if _is_pattern(segment)}
+		with self._lock:
+			node = self._root
+			for segment in self._segments(pattern):
+				if _is_pattern(segment):
+					if segment not in node.patterns:
+						node.patterns[segment] = (regexes[segment], _TopicNode())
+					node = node.patterns[segment][1]
+				else:
+					node = node.literals.setdefault(segment, _TopicNode())
+			node.clients[client] = period
+
+
+	def unsubscribe(self, client, pattern):
+		"""
+		Unsubscribes client from pattern. Returns False if it was not subscribed.
+		"""
+		with self._lock:
+			path = [self._root]
+			for segment in self._segments(pattern):
+				children = path[-1].patterns if _is_pattern(segment) else path[-1].literals
+				if segment not in children:
+					return False
+				child = children[segment]
+				path.append(child[1] if isinstance(child, tuple) else child)
+
+			if client not in path[-1].clients:
+				return False
+			del path[-1].clients[client]
+			self._prune(path, self._segments(pattern))
+			return True
+
+
+	def _prune(self, path, segments):
+		for i in range(len(segments), 0, -1):
+			if not path[i].empty():
+				return
+			parent = path[i - 1]
+			parent.literals.pop(segments[i - 1], None)
+			parent.patterns.pop(segments[i - 1], None)
+
+
+	def subscribers(self, address):
+		"""
+		Returns the clients subscribed to a pattern matching address,
+		as a dict client -> period. The most restrictive matching period wins.
+		"""
+		with self._lock:
+			clients = dict(self._root.clients)
+			nodes = [self._root]
+			for segment in self._segments(address):
+				next_nodes = []
+				for node in nodes:
+					if segment in node.literals:
+						next_nodes.append(node.literals[segment])
+					for (regex, child) in node.patterns.values():
+						if regex.match(segment):
+							next_nodes.append(child)
+				if not next_nodes:
+					break
+				for node in next_nodes:
+					for client, period in node.clients.items():
+						clients[client] = max(clients.get(client, 0), period)
+				nodes = next_nodes
+			return clients
+
+
+class RateLimiter(object):
+	"""
+	Decimates the messages of rate limited subscriptions.
+
+	Only the latest message of each (client, address) is kept,
+	and it is sent at most once per period.
+	"""
+
+	def __init__(self):
+		self._topics = {}  # (client, address) -> [last_sent, period, pending dgram]
+		self._lock = threading.Lock()
+
+
+	def offer(self, client, address, dgram, period, now):
+		"""
+		Returns dgram if it can be sent right now, otherwise keeps it for a later call to due().
+		"""
+		with self._lock:
+			topic = self._topics.get((client, address))
+			if topic is None or now - topic[0] >= period:
+				self._topics[(client, address)] = [now, period, None]
+				return dgram
+			topic[1] = period
+			topic[2] = dgram
+			return None
+
+
+	def due(self, now):
+		"""
+		Returns the (client, dgram) tuples whose period elapsed.
+		"""
+		ready = []
+		with self._lock:
+			for (client, address), topic in self._topics.items():
+				if topic[2] is not None and now - topic[0] >= topic[1]:
+					ready.append((client, topic[2]))
+					topic[0] = now
+					topic[2] = None
+		return ready
+
+
+	def addresses(self, client):
+		"""
+		Returns the addresses decimated for client.
+		"""
+		with self._lock:
+			return [address for (key, address) in self._topics if key == client]
+
+
+	def remove_topic(self, client, address):
+		"""
+		Stops decimating address for client, dropping its pending message.
+		"""
+		with self._lock:
+			self._topics.pop((client, address), None)
+
+
+	def remove_client(self, client):
+		with self._lock:
+			for key in [key for key in self._topics if key[0] == client]:
+				del self._topics[key]
@@ -1,4 +1,6 @@
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 
 def osc_requires(osc_module):
@@ -130,24 +132,62 @@ def param_exists(method):
 
 
 ## MULTI DRONES OSC VALIDATORS
+
+# drones of a multi drones route are handled concurrently, by at most FAN_OUT_WORKERS threads
+FAN_OUT_WORKERS = 8
+_fan_out_executor = None
+_fan_out_lock = threading.Lock()
+_fan_out_local = threading.local()
+
+def _get_fan_out_executor():
+	global _fan_out_executor
+	with _fan_out_lock:
+		if _fan_out_executor is None:
+			_fan_out_executor = ThreadPoolExecutor(max_workers=FAN_OUT_WORKERS,
+				thread_name_prefix='multi-drones')
+		return _fan_out_executor
+
+def drones_ids(self, drones):
+	"""
+	Returns the ids of the drones selected by a {drones} path arg ('*', 'id' or 'id1;id2;...').
+	"""
+	drones = str(drones)
+	if drones == '*':
+		return list(self.server.drones.keys())
+	return [int(drone_id) for drone_id in drones.split(';')]
+
+def _call_for_drone(self, method, args, path_args):
+	# restored afterwards : the next drones of an inline (nested) fan out are still nested
+	previous = getattr(_fan_out_local, 'active', False)
+	_fan_out_local.active = True
+	try:
+		return method(self, *args, **path_args)
+	except Exception as e:
+		self._error('Exception catched :', traceback.format_exc())
+		return e
+	finally:
+		_fan_out_local.active = previous
+
 def multi_drones(method):
+	"""
+	Calls method for every drone in {drones} ('*', 'id' or 'id1;id2;...'), concurrently.
+
+	:returns: a dict drone_id -> result of method (or the exception it raised).
+	"""
 	@wraps(method)
 	@osc_requires('CRAZYFLIE')
 	def wrapped(self, *args, **path_args):
-		drones = str(path_args['drones'])
-		if drones is '*':
-			drones_ids = self.server.drones.keys()
-		elif ';' in drones:
-			drones_ids = drones.split(';')
-		else:
-			drones_ids = [drones]
-
-		for drone_id in drones_ids:
-			path_args['drone_id'] = int(drone_id)
-			try:
-				return method(self, *args, **path_args)
-			except Exception as e:
-				self._error('Exception catched :', traceback.format_exc())
+		calls = [(drone_id, dict(path_args, drone_id=drone_id))
+			for drone_id in drones_ids(self, path_args.pop('drones'))]
+		# a single drone, or nested in a fan out : no need for (and risk of deadlock with) the pool
+		if len(calls) <= 1 or getattr(_fan_out_local, 'active', False):
+			return {drone_id: _call_for_drone(self, method, args, drone_args)
+				for drone_id, drone_args in calls}
+
+		executor = _get_fan_out_executor()
+		futures = [(drone_id, executor.submit(_call_for_drone, self, method, args, drone_args))
+			for drone_id, drone_args in calls]
+		return {drone_id: future.result() for drone_id, future in futures}
 	return wrapped
 
 
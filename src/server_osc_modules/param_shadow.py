@@ -0,0 +1,183 @@
+import struct
+import threading
+import time
+
+# seconds after which an unconfirmed write does not hide the known value anymore
+PENDING_TIMEOUT = 1.0
+
+
+class ParamShadow(object):
+	"""
+	Last known values of the params of one drone, filled from the cflib param update callbacks
+	(which also confirm the writes).
+
+	Writes can opt in to be skipped when the param already has the value, received less than max_age
+	seconds ago (or is being set to it) : values are compared as the bytes cflib would send,
+	so '1', '1.0' and '1.0000000' are the same float.
+	It is opt-in because of the params the firmware resets by itself without telling
+	(ex: kalman.resetEstimation), whose known value can be wrong.
+	"""
+
+	def __init__(self, toc):
+		"""
+		:param toc: the param TOC of the drone (cf.param.toc).
+		:type toc: Toc.
+		"""
+		self.toc = toc
+
+		self._lock = threading.Lock()
+		self._values = {} # complete name -> (value, time.monotonic() of the update)
+		self._pending = {} # complete name -> (packed value, time.monotonic() of the write)
+		self._reads = {} # complete name -> reads requested for a client
+
+		self.updates = 0
+		self.writes = 0
+		self.skipped = 0
+
+
+	def _pack(self, complete_name, value):
+		element = self.toc.get_element_by_complete_name(complete_name)
+		if element is None or not element.pytype:
+			return None
+		try:
+			if element.pytype[-1] in 'fd':
+				return struct.pack(element.pytype, float(value))
+			return struct.pack(element.pytype, int(value))
+		except (ValueError, struct.error):
+			return None
+
+
+	def expect(self, complete_name):
+		"""
+		Records a read of the param requested for a client (see update).
+		"""
+		with self._lock:
+			self._reads[complete_name] = self._reads.get(complete_name, 0) + 1
+
+
+	def update(self, complete_name, value):
+		"""
+		Records a value received from the drone.
+
+		:returns: True if it answers a write or a read expected by a client.
+		"""
+		with self._lock:
+			self._values[complete_name] = (value, time.monotonic())
+			self.updates += 1
+			awaited = self._pending.pop(complete_name, None) is not None
+			if not awaited and complete_name in self._reads:
+				awaited = True
+				self._reads[complete_name] -= 1
+				if not self._reads[complete_name]:
+					del self._reads[complete_name]
+			return awaited
+
+
+	def get(self, complete_name):
+		"""
+		Returns (value, age in seconds) of a param, or (None, None) if it was never received.
+		"""
+		with self._lock:
+			value, updated_at = self._values.get(complete_name, (None, None))
+		if value is None:
+			return None, None
+		return value, time.monotonic() - updated_at
+
+
+	def should_write(self, complete_name, value, max_age=None):
+		"""
+		Records a write of value and returns (True, None), or returns (False, known value) if it can be skipped.
+
+		:param max_age: optional. Skips the write if the param had value less than max_age seconds ago
+			(the known value is then returned), or is being set to it (None is then returned : the
+			drone confirms the pending write). Never skipped without it.
+		:type max_age: float.
+		"""
+		packed = self._pack(complete_name, value)
+		now = time.monotonic()
+		with self._lock:
+			if packed is not None and max_age is not None:
+				pending = self._pending.get(complete_name)
+				if pending is not None and now - pending[1] < min(PENDING_TIMEOUT, max_age):
+					if pending[0] == packed:
+						self.skipped += 1
+						return False, None
+				elif complete_name in self._values:
+					known, updated_at = self._values[complete_name]
+					if now - updated_at <= max_age and self._pack(complete_name, known) == packed:
+						self.skipped += 1
+						return False, known
+			# recorded even if it cannot be compared : its confirmation is awaited
+			self._pending[complete_name] = (packed, now)
+			self.writes += 1
+			return True, None
+
+
+	def values(self):
+		"""
+		Returns a {complete name: value} copy of the known values.
+		"""
+		with self._lock:
+			return {name: value for name, (value, _) in self._values.items()}
+
+
+	def stats(self):
+		with self._lock:
+			return {
+				'known': len(self._values),
+				'pending': len(self._pending),
+				'updates': self.updates,
+				'writes': self.writes,
+				'skipped': self.skipped,
+			}
+
+
+class ParamSnapshot(object):
+	"""
+	Collects the values of every param of a drone's TOC, after a request_update_of_all_params,
+	to send them at once.
+	"""
+
+	def __init__(self, toc):
+		"""
+		:param toc: the params of the TOC, as {group: names}.
+		:type toc: dict.
+		"""
+		self._lock = threading.Lock()
+		self._missing = set(group + '.' + name for group, names in toc.items() for name in names)
+		self._values = {} # group -> {name: value}
+		self.size = len(self._missing)
+		self.started_at = time.monotonic()
+		self.job = None # timeout job
+
+
+	def add(self, complete_name, value):
+		"""
+		Records a received value. Returns False if it was not awaited (not in the TOC, or already received).
+		"""
+		with self._lock:
+			if complete_name not in self._missing:
+				return False
+			self._missing.discard(complete_name)
+			group, name = complete_name.split('.', 1)
+			self._values.setdefault(group, {})[name] = value
+			return True
+
+
+	@property
+	def complete(self):
+		with self._lock:
+			return not self._missing
+
+
+	def missing(self):
+		with self._lock:
+			return sorted(self._missing)
+
+
+	def values(self):
+		"""
+		Returns the received values as {group: {name: value}}.
+		"""
+		with self._lock:
+			return {group: dict(values) for group, values in self._values.items()}
@@ -0,0 +1,163 @@
+import threading
+import time
+import traceback
+
+from collections import deque
+
+# command classes, most urgent first
+PRIORITY_EMERGENCY = 0
+PRIORITY_SETPOINT = 1
+PRIORITY_PARAM = 2
+PRIORITY_LOG = 3
+PRIORITY_TOC = 4
+
+PRIORITY_NAMES = ('emergency', 'setpoint', 'param', 'log', 'toc')
+
+
+class RadioCommandQueue(object):
+	"""
+	Queue of the radio commands (functions calling cflib) of one drone, in front of its Crazyflie object.
+
+	A dedicated thread runs the commands one at a time, most urgent class first,
+	so that bulk param or TOC traffic does not delay flight critical packets.
+	Commands pushed with a key are latest-wins : while one is waiting, a newer one replaces it.
+	Commands pushed with a max_age are dropped if they waited longer (ex: stale setpoints on a busy link).
+
+	The thread is per drone, not shared : cflib hands each packet to the link through a one-slot queue,
+	with a put blocking up to 2s, so a weak link may block every call. It must only delay its own drone,
+	not the emergency stops of the others (nor the scheduler thread).
+	"""
+
+	def __init__(self, name, max_depth=256):
+		self.name = name
+		self.max_depth = max_depth
+
+		self._queues = [deque() for _ in PRIORITY_NAMES]
+		self._keyed = {} # key -> waiting [command, key, deadline] cell
+		self._condition = threading.Condition()
+		self._running = False
+		self._thread = None
+
+		self.sent = [0] * len(PRIORITY_NAMES)
+		self.replaced = [0] * len(PRIORITY_NAMES)
+		self.dropped = [0] * len(PRIORITY_NAMES)
+		self.stale = [0] * len(PRIORITY_NAMES)
+		self.errors = 0
+		self.in_flight = None # class of the running command
+		self.max_depth_seen = 0
+
+
+	def push(self, priority, command, key=None, max_age=None):
+		"""
+		Queues command (called without arguments on the queue thread).
+
+		:param priority: one of the PRIORITY_* classes.
+		:type priority: int.
+		:param key: optional. Replaces the waiting command with the same key, if any.
+		:type key: str.
+		:param max_age: optional. Seconds after which the command is not worth sending anymore.
+		:type max_age: float.
+		:returns: False if the command was dropped (queue full).
+		"""
+		deadline = time.monotonic() + max_age if max_age is not None else None
+		with self._condition:
+			if key is not None and key in self._keyed:
+				cell = self._keyed[key]
+				cell[0] = command
+				cell[2] = deadline
+				self.replaced[priority] += 1
+				return True
+			depth = self._depth()
+			if depth >= self.max_depth and priority != PRIORITY_EMERGENCY:
+				self.dropped[priority] += 1
+				return False
+			cell = [command, key, deadline]
+			self._queues[priority].append(cell)
+			if key is not None:
+				self._keyed[key] = cell
+			self.max_depth_seen = max(self.max_depth_seen, depth + 1)
+			self._condition.notify()
+			return True
+
+
+	def discard(self, priority):
+		"""
+		Drops the waiting commands of a class (ex: setpoints after an emergency).
+		"""
+		with self._condition:
+			for _, key, _ in self._queues[priority]:
+				if key is not None:
+					self._keyed.pop(key, None)
+			self.dropped[priority] += len(self._queues[priority])
+			self._queues[priority].clear()
+
+
+	def outstanding(self):
+		"""
+		Returns the number of commands accepted for the link and not handed to cflib yet
+		(waiting, or being sent) : it grows when the link cannot keep up.
+		"""
+		with self._condition:
+			return self._depth() + (self.in_flight is not None)
+
+
+	def _depth(self):
+		return sum(len(queue) for queue in self._queues)
+
+
+	def _run(self):
+		while True:
+			with self._condition:
+				while self._running and self._depth() == 0:
+					self._condition.wait()
+				if not self._running:
+					return
+				priority = next(i for i, queue in enumerate(self._queues) if queue)
+				command, key, deadline = self._queues[priority].popleft()
+				if key is not None:
+					del self._keyed[key]
+				if deadline is not None and time.monotonic() > deadline:
+					self.stale[priority] += 1
+					continue
+				self.in_flight = priority
+			try:
+				command()
+			except Exception:
+				self.errors += 1
+				traceback.print_exc()
+			with self._condition:
+				self.in_flight = None
+				self.sent[priority] += 1
+
+
+	def start(self):
+		self._running = True
+		self._thread = threading.Thread(target=self._run, name=self.name)
+		self._thread.start()
+
+
+	def stop(self):
+		"""
+		Stops the queue thread. Waiting commands are dropped.
+		"""
+		with self._condition:
+			self._running = False
+			self._condition.notify_all()
+		if self._thread is not None and self._thread is not threading.current_thread():
+			self._thread.join()
+		self._thread = None
+
+
+	def stats(self):
+		with self._condition:
+			return {
+				'depth': {name: len(queue) for name, queue in zip(PRIORITY_NAMES, self._queues)},
+				'max_depth': self.max_depth_seen,
+				'sent': dict(zip(PRIORITY_NAMES, self.sent)),
+				'replaced': dict(zip(PRIORITY_NAMES, self.replaced)),
+				'dropped': dict(zip(PRIORITY_NAMES, self.dropped)),
+				'stale': dict(zip(PRIORITY_NAMES, self.stale)),
+				'outstanding': self._depth() + (self.in_flight is not None),
+				'in_flight': PRIORITY_NAMES[self.in_flight] if self.in_flight is not None else None,
+				'errors': self.errors,
+			}
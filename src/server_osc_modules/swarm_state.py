@@ -0,0 +1,275 @@
+import threading
+
+import numpy as np
+
+DEFAULT_RATE = 10 # setpoints per second
+MAX_RATE = 100
+
+# packed (id, x, y, z, yaw) goal records : big-endian int32 and float32, like every OSC number
+GOAL_RECORD_DTYPE = np.dtype([('id', '>i4'), ('goal', '>f4', (4,))])
+GOAL_ID_DTYPE = np.dtype('>i4')
+GOAL_VALUE_DTYPE = np.dtype('>f4')
+
+
+def parse_goals(*blobs):
+	"""
+	Decodes swarm goals without copying the datagram, either from one blob of packed
+	(id, x, y, z, yaw) records, or from 5 parallel blobs (ids, xs, ys, zs, yaws).
+
+	:returns: (ids, goals) : (n,) int and (n, 4) float arrays.
+	:raises ValueError: if the blobs are malformed, or a goal is not finite (NaN or inf).
+	"""
+	if len(blobs) == 1:
+		if len(blobs[0]) % GOAL_RECORD_DTYPE.itemsize != 0:
+			raise ValueError('goals must be packed (int32 id, 4 float32) records')
+		records = np.frombuffer(blobs[0], dtype=GOAL_RECORD_DTYPE)
+		ids, goals = records['id'], records['goal']
+	elif len(blobs) == 5:
+		ids = np.frombuffer(blobs[0], dtype=GOAL_ID_DTYPE)
+		values = [np.frombuffer(blob, dtype=GOAL_VALUE_DTYPE) for blob in blobs[1:]]
+		if any(len(v) != len(ids) for v in values):
+			raise ValueError('goal arrays must have the same length')
+		goals = np.column_stack(values)
+	else:
+		raise ValueError('expected 1 blob of records or 5 parallel blobs')
+	if not np.isfinite(goals).all():
+		raise ValueError('goals must be finite')
+	return ids, goals
+
+
+class SwarmState(object):
+	"""
+	Struct-of-arrays state of the swarm : each drone owns a slot (a row) in every array,
+	so that the whole swarm setpoints are computed in one vectorized step.
+
+	goals are (x, y, z, yaw) in the world frame. setpoints() transforms them
+	to the drones frame (frame_offset), then clamps them in the geofence.
+	"""
+
+	def __init__(self, capacity=64):
+		self._lock = threading.RLock()
+		self.slots = {} # drone_id -> slot
+		self.frame_offset = np.zeros(4) # x, y, z, yaw added to every goal
+		self.geofence_min = np.array([-np.inf, -np.inf, 0.0]) # do not send negative z waypoints
+		self.geofence_max = np.array([np.inf, np.inf, np.inf])
+		self._allocate(capacity)
+
+
+	def _allocate(self, capacity):
+		def grow(array, fill):
+			new = np.full((capacity,) + array.shape[1:], fill, dtype=array.dtype)
+			new[:len(array)] = array
+			return new
+
+		if not hasattr(self, 'ids'):
+			self.ids = np.zeros(0, dtype=np.int64)
+			self.used = np.zeros(0, dtype=bool)
+			self.goals = np.zeros((0, 4))
+			self.has_goal = np.zeros(0, dtype=bool)
+			self.emergency = np.zeros(0, dtype=bool)
+			self.connected = np.zeros(0, dtype=bool)
+			self.position = np.zeros((0, 3))
+			self.rate = np.zeros(0)
+			self.onboard = np.zeros(0, dtype=bool)
+
+		self.ids = grow(self.ids, -1)
+		self.used = grow(self.used, False)
+		self.goals = grow(self.goals, 0.0)
+		self.has_goal = grow(self.has_goal, False)
+		self.emergency = grow(self.emergency, False)
+		self.connected = grow(self.connected, False)
+		self.position = grow(self.position, np.nan)
+		self.rate = grow(self.rate, DEFAULT_RATE)
+		self.onboard = grow(self.onboard, False)
+
+
+	def add(self, drone_id):
+		"""
+		Gives a slot to drone_id (reusing free slots first) and returns it.
+		"""
+		with self._lock:
+			if drone_id in self.slots:
+				return self.slots[drone_id]
+			free = np.flatnonzero(~self.used)
+			if len(free) == 0:
+				slot = len(self.used)
+				self._allocate(2 * len(self.used))
+			else:
+				slot = int(free[0])
+			self.used[slot] = True
+			self.ids[slot] = drone_id
+			self.goals[slot] = 0.0
+			self.has_goal[slot] = False
+			self.emergency[slot] = False
+			self.connected[slot] = False
+			self.position[slot] = np.nan
+			self.rate[slot] = DEFAULT_RATE
+			self.onboard[slot] = False
+			self.slots[drone_id] = slot
+			return slot
+
+
+	def dump(self):
+		"""
+		Returns the state of every drone, as {drone_id: {...}} of plain values (unknown positions are None).
+		"""
+		with self._lock:
+			return {
+				drone_id: {
+					'connected': bool(self.connected[slot]),
+					'emergency': bool(self.emergency[slot]),
+					'goal': self.goals[slot].tolist() if self.has_goal[slot] else None,
+					'position': None if np.isnan(self.position[slot]).any() else self.position[slot].tolist(),
+					'rate': float(self.rate[slot]),
+					'onboard': bool(self.onboard[slot]),
+				}
+				for drone_id, slot in self.slots.items()
+			}
+
+
+	def remove(self, drone_id):
+		with self._lock:
+			slot = self.slots.pop(drone_id, None)
+			if slot is not None:
+				self.used[slot] = False
+				self.connected[slot] = False
+				self.has_goal[slot] = False
+				self.ids[slot] = -1
+
+
+	def set_goal(self, drone_id, goal):
+		"""
+		:raises ValueError: if the goal is not finite (NaN or inf).
+		"""
+		goal = np.asarray(goal, dtype=float)
+		if not np.isfinite(goal).all():
+			raise ValueError('goal must be finite')
+		with self._lock:
+			slot = self.slots[drone_id]
+			self.goals[slot] = goal
+			self.has_goal[slot] = True
+
+
+	def set_goals(self, drone_ids, goals):
+		"""
+		Sets the goals of several drones at once : no setpoints computation sees only part of them.
+
+		:returns: the ids that are not in the swarm (and were ignored).
+		:raises ValueError: if a goal is not finite (NaN or inf) : none is set.
+		"""
+		if not np.isfinite(goals).all():
+			raise ValueError('goals must be finite')
+		with self._lock:
+			slots = np.fromiter((self.slots.get(drone_id, -1) for drone_id in drone_ids.tolist()),
+				dtype=np.int64, count=len(drone_ids))
+			known = slots >= 0
+			self.goals[slots[known]] = goals[known]
+			self.has_goal[slots[known]] = True
+			return drone_ids[~known]
+
+
+	def clear_goal(self, drone_id):
+		with self._lock:
+			self.has_goal[self.slots[drone_id]] = False
+
+
+	def set_emergency(self, drone_id, emergency=True):
+		with self._lock:
+			self.emergency[self.slots[drone_id]] = emergency
+
+
+	def set_connected(self, drone_id, connected):
+		with self._lock:
+			if drone_id in self.slots:
+				self.connected[self.slots[drone_id]] = connected
+
+
+	def set_position(self, drone_id, position):
+		with self._lock:
+			if drone_id in self.slots:
+				self.position[self.slots[drone_id]] = position
+
+
+	def set_rate(self, drone_id, rate):
+		with self._lock:
+			self.rate[self.slots[drone_id]] = rate
+
+
+	def get_rate(self, drone_id):
+		with self._lock:
+			return float(self.rate[self.slots[drone_id]])
+
+
+	def rates(self):
+		"""
+		Returns the set of setpoint rates used by the drones.
+		"""
+		with self._lock:
+			return set(self.rate[self.used].tolist())
+
+
+	def set_onboard(self, drone_id, onboard):
+		"""
+		Drones flying an onboard trajectory are not sent setpoints (unless in emergency).
+		"""
+		with self._lock:
+			if drone_id in self.slots:
+				self.onboard[self.slots[drone_id]] = onboard
+
+
+	def set_geofence(self, minimum, maximum):
+		with self._lock:
+			self.geofence_min = np.array(minimum, dtype=float)
+			self.geofence_max = np.array(maximum, dtype=float)
+
+
+	def set_frame_offset(self, offset):
+		with self._lock:
+			self.frame_offset = np.array(offset, dtype=float)
+
+
+	def setpoints(self, rate=None):
+		"""
+		Computes the setpoints of every connected drone (sending at rate, if given) in one step.
+		Goals that are not finite in the drones frame are not sent.
+
+		:returns: (drone_ids, emergency, goals) arrays for the drones to send something to :
+			emergency drones must be stopped, the others sent their goal (x, y, z, yaw).
+		"""
+		with self._lock:
+			mask = self.connected & (self.emergency | (self.has_goal & ~self.onboard))
+			if rate is not None:
+				mask &= self.rate == rate
+			ids, emergency, goals = self.ids[mask], self.emergency[mask], self._to_drone_frame(self.goals[mask])
+			valid = emergency | np.isfinite(goals).all(axis=1)
+			return ids[valid], emergency[valid], goals[valid]
+
+
+	def to_drone_frame(self, goals):
+		"""
+		Transforms (n, 4) world frame goals to the drones frame, clamped in the geofence.
+		"""
+		with self._lock:
+			return self._to_drone_frame(np.asarray(goals, dtype=float))
+
+
+	def from_drone_frame(self, points):
+		"""
+		Transforms (n, 4) drones frame points back to the world frame.
+		"""
+		with self._lock:
+			return np.asarray(points, dtype=float) - self.frame_offset
+
+
+	def geofence(self):
+		"""
+		Returns the (minimum, maximum) corners of the geofence, in the drones frame.
+		"""
+		with self._lock:
+			return self.geofence_min.copy(), self.geofence_max.copy()
+
+
+	def _to_drone_frame(self, goals):
+		goals = goals + self.frame_offset
+		goals[:, :3] = np.clip(goals[:, :3], self.geofence_min, self.geofence_max)
+		return goals
@@ -0,0 +1,128 @@
+import json
+import os
+import threading
+
+from cflib.crazyflie.toccache import TocCache
+
+# the TOCs a drone fetches on connection, in order
+TOC_KINDS = ('log', 'param')
+
+
+class TocView(object):
+	"""
+	A TOC as sent to the clients : group -> sorted variable names, and its JSON.
+	"""
+
+	def __init__(self, toc):
+		self.groups = {group: sorted(variables) for group, variables in toc.items()}
+		self.json = json.dumps(self.groups)
+
+
+class SharedTocCache(TocCache):
+	"""
+	TOC cache shared by every Crazyflie of the server, keyed by TOC CRC :
+	drones running the same firmware download their log and param TOCs once.
+
+	TOCs are kept in memory, and in directory (when given) to survive restarts.
+	"""
+
+	def __init__(self, directory=None):
+		if directory:
+			# cflib only globs and writes in the directory : it does not create it
+			os.makedirs(directory, exist_ok=True)
+		super(SharedTocCache, self).__init__(rw_cache=directory or None)
+		self.directory = directory or None
+		self._lock = threading.Lock()
+		self._tocs = {} # crc -> toc
+		self._views = {} # (kind, crc) -> TocView
+		self.hits = 0
+		self.misses = 0
+		self.inserts = 0
+
+
+	def fetch(self, crc):
+		with self._lock:
+			toc = self._tocs.get(crc)
+		if toc is None and self.directory:
+			toc = super(SharedTocCache, self).fetch(crc)
+		with self._lock:
+			if toc is None:
+				self.misses += 1
+			else:
+				self.hits += 1
+				self._tocs[crc] = toc
+		return toc
+
+
+	def insert(self, crc, toc):
+		if self.directory:
+			super(SharedTocCache, self).insert(crc, toc)
+		with self._lock:
+			self._tocs[crc] = toc
+			self.inserts += 1
+
+
+	def view(self, kind, crc, toc):
+		"""
+		Returns the TocView of a log or param toc, built once per CRC.
+		"""
+		if crc is None:
+			return TocView(toc)
+		with self._lock:
+			view = self._views.get((kind, crc))
+		if view is None:
+			view = TocView(toc)
+			with self._lock:
+				view = self._views.setdefault((kind, crc), view)
+		return view
+
+
+	def for_drone(self, on_fetch):
+		"""
+		Returns a cache for one Crazyflie, calling on_fetch(crc, hit) on each TOC fetch.
+		"""
+		return _DroneTocCache(self, on_fetch)
+
+
+	def stats(self):
+		with self._lock:
+			return {
+				'directory': self.directory,
+				'tocs': len(self._tocs),
+				'views': len(self._views),
+				'hits': self.hits,
+				'misses': self.misses,
+				'inserts': self.inserts,
+			}
+
+
+class _DroneTocCache(object):
+	def __init__(self, shared, on_fetch):
+		self.shared = shared
+		self.on_fetch = on_fetch
+
+
+	def fetch(self, crc):
+		toc = self.shared.fetch(crc)
+		self.on_fetch(crc, toc is not None)
+		return toc
+
+
+	def insert(self, crc, toc):
+		self.shared.insert(crc, toc)
+
+
+def drone_toc_view(server, drone_id, kind):
+	"""
+	Returns the TocView of the log or param TOC of a connected drone.
+	Views are shared by the drones with the same TOC CRC, and forgotten on reconnection.
+	"""
+	drone = server.drones[drone_id]
+	view = drone['toc_views'].get(kind)
+	if view is None:
+		index = TOC_KINDS.index(kind)
+		fetches = drone['toc_fetches']
+		crc = fetches[index][0] if index < len(fetches) else None
+		view = server.toc_cache.view(kind, crc, getattr(drone['cf'], kind).toc.toc)
+		drone['toc_views'][kind] = view
+	return view
@@ -0,0 +1,138 @@
+import numpy as np
+
+# big-endian float32 (t, x, y, z, yaw) records, like every OSC number
+WAYPOINT_DTYPE = np.dtype('>f4')
+WAYPOINT_SIZE = 5
+
+# crazyflie trajectory memory : pieces of 4 (x, y, z, yaw) polynomials of 8 coefficients,
+# followed by the piece duration, little-endian float32
+POLY4D_COEFFS = 8
+POLY4D_DTYPE = np.dtype('<f4')
+POLY4D_PIECE_SIZE = (4 * POLY4D_COEFFS + 1) * POLY4D_DTYPE.itemsize
+
+
+def parse_waypoints(data):
+	"""
+	Parses timed waypoints, either a blob of packed (t, x, y, z, yaw) float32 records,
+	or a flat list of floats (t0, x0, y0, z0, yaw0, t1, x1, ...).
+
+	:returns: a (n, 5) float array, sorted by time.
+	"""
+	if isinstance(data, (bytes, bytearray, memoryview)):
+		values = np.frombuffer(data, dtype=WAYPOINT_DTYPE)
+	else:
+		values = np.asarray(data, dtype=float)
+	if len(values) == 0 or len(values) % WAYPOINT_SIZE != 0:
+		raise ValueError('waypoints must be (t, x, y, z, yaw) records')
+	waypoints = values.reshape(-1, WAYPOINT_SIZE).astype(float)
+	if not np.isfinite(waypoints).all():
+		raise ValueError('waypoints must be finite')
+	waypoints = waypoints[np.argsort(waypoints[:, 0], kind='stable')]
+	if np.any(np.diff(waypoints[:, 0]) <= 0):
+		raise ValueError('waypoints times must be distinct')
+	return waypoints
+
+
+class Trajectory(object):
+	"""
+	A timed waypoint trajectory, interpolated linearly or with cubic Hermite splines
+	(Catmull-Rom like slopes, zero velocity at both ends).
+	"""
+
+	INTERPOLATIONS = ('linear', 'cubic')
+
+	def __init__(self, waypoints, interpolation='linear'):
+		if interpolation not in self.INTERPOLATIONS:
+			raise ValueError('unknown interpolation: ' + str(interpolation))
+		self.interpolation = interpolation
+		self.times = waypoints[:, 0] - waypoints[0, 0]
+		self.points = waypoints[:, 1:]
+		self.duration = self.times[-1]
+
+		if len(self.times) > 1:
+			self.slopes = np.gradient(self.points, self.times, axis=0)
+			self.slopes[0] = 0
+			self.slopes[-1] = 0
+		else:
+			self.slopes = np.zeros_like(self.points)
+
+
+	def sample(self, t):
+		"""
+		Returns the (x, y, z, yaw) point at t seconds from the start (held at both ends).
+		"""
+		if t <= 0 or len(self.times) == 1:
+			return self.points[0]
+		if t >= self.duration:
+			return self.points[-1]
+
+		i = int(np.searchsorted(self.times, t, side='right')) - 1
+		dt = self.times[i + 1] - self.times[i]
+		s = (t - self.times[i]) / dt
+		p0, p1 = self.points[i], self.points[i + 1]
+		if self.interpolation == 'linear':
+			return p0 + s * (p1 - p0)
+
+		h00 = 2*s**3 - 3*s**2 + 1
+		h10 = s**3 - 2*s**2 + s
+		h01 = -2*s**3 + 3*s**2
+		h11 = s**3 - s**2
+		return h00*p0 + h10*dt*self.slopes[i] + h01*p1 + h11*dt*self.slopes[i + 1]
+
+
+	def poly4d(self):
+		"""
+		Compiles the trajectory into one polynomial piece per waypoint interval,
+		as flown by the crazyflie high level commander : p(tau) = sum(c[k] * tau**k),
+		tau being the time since the start of the piece.
+
+		:returns: (durations, coefficients) : (n,) and (n, 4, 8) arrays.
+		"""
+		durations = np.diff(self.times)
+		p0, p1 = self.points[:-1], self.points[1:]
+		T = durations[:, None]
+		coefficients = np.zeros((len(durations), 4, POLY4D_COEFFS))
+		coefficients[:, :, 0] = p0
+		if self.interpolation == 'linear':
+			coefficients[:, :, 1] = (p1 - p0) / T
+		else:
+			m0, m1 = self.slopes[:-1], self.slopes[1:]
+			coefficients[:, :, 1] = m0
+			coefficients[:, :, 2] = (3 * (p1 - p0) / T - 2 * m0 - m1) / T
+			coefficients[:, :, 3] = (2 * (p0 - p1) / T + m0 + m1) / T**2
+		return durations, coefficients
+
+
+def evaluate_poly4d(durations, coefficients, t):
+	"""
+	Evaluates polynomial pieces at t seconds from the start, like the drone does
+	(held at both ends) : where a drone flying an uploaded trajectory was sent to at t.
+	"""
+	if t <= 0:
+		return coefficients[0, :, 0].copy()
+	ends = np.cumsum(durations)
+	i = min(int(np.searchsorted(ends, t, side='right')), len(durations) - 1)
+	tau = min(t - (ends[i] - durations[i]), durations[i])
+	return np.polynomial.polynomial.polyval(tau, coefficients[i].T)
+
+
+def poly4d_bounds(durations, coefficients):
+	"""
+	Returns the (x, y, z) minimum and maximum reached by polynomial pieces,
+	between their waypoints included (cubic pieces can overshoot them).
+
+	:returns: (minimum, maximum) : two (3,) arrays.
+	"""
+	minimum = np.full(3, np.inf)
+	maximum = np.full(3, -np.inf)
+	for duration, polys in zip(durations, coefficients):
+		for axis in range(3):
+			poly = np.trim_zeros(polys[axis], 'b')
+			taus = [0.0, duration]
+			if len(poly) > 2:
+				roots = np.polynomial.polynomial.polyroots(np.polynomial.polynomial.polyder(poly))
+				taus += [root.real for root in roots if abs(root.imag) < 1e-9 and 0 < root.real < duration]
+			values = np.polynomial.polynomial.polyval(np.array(taus), polys[axis])
+			minimum[axis] = min(minimum[axis], values.min())
+			maximum[axis] = max(maximum[axis], values.max())
+	return minimum, maximum